@@ -0,0 +1,17 @@
+"""Display and input backends for core.Machine.
+
+A backend creates the display (GFX) and keyboard (HexKeyboard) objects used
+by a machine. The headless backend has no UI dependencies; the pygame /
+OpenCV backend lives in chippy.sdl and is only imported when requested.
+"""
+from . import graphics, keyboard
+
+
+class HeadlessBackend(object):
+    """Backend keeping the framebuffer (bit-packed) and key state headless."""
+
+    def create_gfx(self):
+        return graphics.PackedGFX()
+
+    def create_keyboard(self):
+        return keyboard.HexKeyboard()
@@ -0,0 +1,488 @@
+"""Lockstep emulation of many machines held in NumPy arrays.
+
+A BatchMachine runs N instances of (usually) the same ROM side by side. All
+machine state is stored in arrays with a leading instance axis and every
+step decodes the current opcode of all instances at once. Instances are then
+grouped by instruction and each instruction is applied as one vectorised
+update over its group, so the cost of a step grows far slower than N.
+
+Batched instances are headless and use a per-instance xorshift RNG, seeded
+on construction, in place of the random module. Quirk profiles (cf.
+instructions.QUIRKS) are supported: a profile's handlers replace the default
+ones when the ROM is loaded.
+"""
+import numpy as np
+
+from . import core
+from .graphics import CHIP8_HEIGHT, CHIP8_WIDTH, SCHIP_HEIGHT, SCHIP_WIDTH
+from .instructions import InstructionSet
+
+STACK_SIZE = 16  # Maximum subroutine depth
+
+
+def build_kind_table():
+    """Return the handler names and a table mapping opcode -> handler index.
+
+    Index 0 is reserved for unknown opcodes ('_NOP').
+    """
+    names = ["_NOP"] + sorted(InstructionSet.handler_names())
+    codes = np.arange(2**16)
+    kinds = np.zeros(2**16, np.uint8)
+
+    for kind, name in enumerate(names[1:], 1):
+        match = np.ones(2**16, bool)
+        for pos, sym in enumerate(name[1:]):
+            if sym != "M":
+                match &= ((codes >> 4 * (3 - pos)) & 0xF) == int(sym, 16)
+        kinds[match] = kind
+
+    return names, kinds
+
+
+class BatchMachine(object):
+    """N CHIP8 / SCHIP machines emulated in lockstep.
+
+    Parameters
+    ----------
+    n : int
+        Number of machine instances.
+    seeds : array_like of int, optional
+        Per-instance RNG seeds (default: 0, 1, ..., n - 1).
+    """
+
+    NAMES, KINDS = build_kind_table()
+
+    def __init__(self, n, seeds=None):
+        self.n = n
+        self.game = ""
+        self.quirks = None
+
+        # Machine state, one row per instance
+        self.memory = np.zeros([n, core.Machine.MEMORY], np.uint8)
+        self.V = np.zeros([n, core.Machine.REGISTERS], np.uint8)
+        self.I = np.zeros(n, np.int32)
+        self.pc = np.full(n, core.Machine.PC_START, np.int32)
+        self.delay_timer = np.zeros(n, np.int32)
+        self.sound_timer = np.zeros(n, np.int32)
+        self.stack = np.zeros([n, STACK_SIZE], np.int32)
+        self.sp = np.zeros(n, np.int32)
+        self.flags = np.zeros([n, 8], np.uint8)
+
+        # Display and input
+        self.screen = np.zeros([n, SCHIP_HEIGHT, SCHIP_WIDTH], bool)
+        self.width = np.full(n, CHIP8_WIDTH, np.int32)
+        self.height = np.full(n, CHIP8_HEIGHT, np.int32)
+        self.collision_flag = np.zeros(n, bool)
+        self.keys = np.zeros([n, 16], bool)
+
+        # Instances stop on exit (00FD) or a stack fault
+        self.halted = np.zeros(n, bool)
+
+        seeds = np.arange(n) if seeds is None else np.asarray(seeds)
+        self.seed(seeds)
+
+        self.cycles = 0
+        self._handlers = [getattr(self, name) for name in BatchMachine.NAMES]
+
+    def seed(self, seeds):
+        """Reseed the per-instance RNGs."""
+        state = np.asarray(seeds, np.uint64) * np.uint64(2654435761) + 1
+        state &= 0xFFFFFFFF
+        self.rng_state = np.where(state == 0, 1, state).astype(np.uint32)
+
+    def load_game(self, game_path, quirks=None):
+        """Load a ROM into every instance and reset them.
+
+        The quirk profile defaults as in Machine.load_game.
+        """
+        machine = core.Machine()
+        machine.load_game(game_path, quirks)
+        self.game = machine.game
+        self.quirks = machine.quirks
+
+        profile = _QUIRKS.get(self.quirks)
+        self._handlers = [
+            getattr(profile, name).__get__(self)
+            if hasattr(profile, name)
+            else getattr(self, name)
+            for name in BatchMachine.NAMES
+        ]
+
+        self.memory[:] = machine.memory_view
+        self.V[:] = 0
+        self.I[:] = 0
+        self.pc[:] = core.Machine.PC_START
+        self.delay_timer[:] = 0
+        self.sound_timer[:] = 0
+        self.sp[:] = 0
+        self.screen[:] = False
+        self.width[:] = CHIP8_WIDTH
+        self.height[:] = CHIP8_HEIGHT
+        self.collision_flag[:] = False
+        self.keys[:] = False
+        self.halted[:] = False
+
+    def press(self, key, instances=slice(None)):
+        self.keys[instances, key] = True
+
+    def release(self, key, instances=slice(None)):
+        self.keys[instances, key] = False
+
+    def decrement_timers(self):
+        self.delay_timer -= self.delay_timer > 0
+        self.sound_timer -= self.sound_timer > 0
+
+    def emulate_cycle(self):
+        """Fetch, decode and execute one instruction on every instance."""
+        active = np.nonzero(~self.halted)[0]
+        if not active.size:
+            return
+
+        pc = self.pc[active]
+        code = (self.memory[active, pc & 0xFFF].astype(np.int32) << 8) | (
+            self.memory[active, (pc + 1) & 0xFFF]
+        )
+        self.pc[active] = pc + 2
+
+        # Group instances by instruction
+        kinds = BatchMachine.KINDS[code]
+        order = np.argsort(kinds, kind="stable")
+        bounds = np.cumsum(np.bincount(kinds, minlength=len(self._handlers)))
+        active, code = active[order], code[order]
+
+        start = 0
+        for kind, stop in enumerate(bounds):
+            if stop > start:
+                group = code[start:stop]
+                self._handlers[kind](
+                    active[start:stop],
+                    (group >> 8) & 0xF,
+                    (group >> 4) & 0xF,
+                    group & 0xF,
+                    group & 0xFF,
+                    group & 0xFFF,
+                )
+            start = stop
+
+        self.cycles += 1
+
+    def run(self, cycles):
+        for _ in range(cycles):
+            self.emulate_cycle()
+
+    # ===== HELPERS ========================================================= #
+    def _skip(self, i, condition):
+        self.pc[i[condition]] += 2
+
+    def _random(self, i):
+        state = self.rng_state[i]
+        state ^= state << np.uint32(13)
+        state ^= state >> np.uint32(17)
+        state ^= state << np.uint32(5)
+        self.rng_state[i] = state
+        return (state >> np.uint32(24)).astype(np.uint8)
+
+    def _scroll(self, i, shift, direction):
+        for hi in (False, True):
+            j = i[(self.width[i] == SCHIP_WIDTH) == hi]
+            if not j.size:
+                continue
+
+            h, w = (SCHIP_HEIGHT, SCHIP_WIDTH) if hi else (CHIP8_HEIGHT, CHIP8_WIDTH)
+            screen = self.screen[j, :h, :w]
+            if direction == "down":
+                screen[:, shift:, :] = screen[:, :-shift, :]
+                screen[:, :shift, :] = False
+            elif direction == "right":
+                screen[:, :, shift:] = screen[:, :, :-shift]
+                screen[:, :, :shift] = False
+            else:
+                screen[:, :, :-shift] = screen[:, :, shift:]
+                screen[:, :, -shift:] = False
+            self.screen[j, :h, :w] = screen
+
+    def _set_resolution(self, i, width, height):
+        self.width[i] = width
+        self.height[i] = height
+        self.screen[i] = False
+
+    # ===== INSTRUCTIONS ==================================================== #
+    # Each handler is applied to the instances i whose current opcode it
+    # handles, with the opcode's X, Y, N, NN and NNN operands as arrays.
+    def _00CM(self, i, X, Y, N, NN, NNN):  # 00CN
+        for shift in np.unique(N[N > 0]):
+            self._scroll(i[N == shift], shift, "down")
+
+    def _00FB(self, i, X, Y, N, NN, NNN):  # 00FB
+        self._scroll(i, 4, "right")
+
+    def _00FC(self, i, X, Y, N, NN, NNN):  # 00FC
+        self._scroll(i, 4, "left")
+
+    def _00FD(self, i, X, Y, N, NN, NNN):  # 00FD
+        self.halted[i] = True
+
+    def _00FE(self, i, X, Y, N, NN, NNN):  # 00FE
+        self._set_resolution(i, CHIP8_WIDTH, CHIP8_HEIGHT)
+
+    def _00FF(self, i, X, Y, N, NN, NNN):  # 00FF
+        self._set_resolution(i, SCHIP_WIDTH, SCHIP_HEIGHT)
+
+    def _00E0(self, i, X, Y, N, NN, NNN):  # 00E0
+        self.screen[i] = False
+
+    def _00EE(self, i, X, Y, N, NN, NNN):  # 00EE
+        fault = self.sp[i] == 0
+        self.halted[i[fault]] = True
+
+        i = i[~fault]
+        self.sp[i] -= 1
+        self.pc[i] = self.stack[i, self.sp[i]]
+
+    def _1MMM(self, i, X, Y, N, NN, NNN):  # 1NNN
+        self.pc[i] = NNN
+
+    def _2MMM(self, i, X, Y, N, NN, NNN):  # 2NNN
+        fault = self.sp[i] == STACK_SIZE
+        self.halted[i[fault]] = True
+
+        i, NNN = i[~fault], NNN[~fault]
+        self.stack[i, self.sp[i]] = self.pc[i]
+        self.sp[i] += 1
+        self.pc[i] = NNN
+
+    def _3MMM(self, i, X, Y, N, NN, NNN):  # 3XNN
+        self._skip(i, self.V[i, X] == NN)
+
+    def _4MMM(self, i, X, Y, N, NN, NNN):  # 4XNN
+        self._skip(i, self.V[i, X] != NN)
+
+    def _5MMM(self, i, X, Y, N, NN, NNN):  # 5XY0
+        self._skip(i, self.V[i, X] == self.V[i, Y])
+
+    def _6MMM(self, i, X, Y, N, NN, NNN):  # 6XNN
+        self.V[i, X] = NN
+
+    def _7MMM(self, i, X, Y, N, NN, NNN):  # 7XNN
+        self.V[i, X] = (self.V[i, X] + NN) & 0xFF
+
+    def _8MM0(self, i, X, Y, N, NN, NNN):  # 8XY0
+        self.V[i, X] = self.V[i, Y]
+
+    def _8MM1(self, i, X, Y, N, NN, NNN):  # 8XY1
+        self.V[i, X] |= self.V[i, Y]
+        self.V[i, 0xF] = 0
+
+    def _8MM2(self, i, X, Y, N, NN, NNN):  # 8XY2
+        self.V[i, X] &= self.V[i, Y]
+        self.V[i, 0xF] = 0
+
+    def _8MM3(self, i, X, Y, N, NN, NNN):  # 8XY3
+        self.V[i, X] ^= self.V[i, Y]
+        self.V[i, 0xF] = 0
+
+    # Flag setting instructions write VF before re-reading VX / VY, exactly
+    # as the stepwise handlers do (this matters when X or Y is 0xF).
+    def _8MM4(self, i, X, Y, N, NN, NNN):  # 8XY4
+        vx, vy = self.V[i, X].astype(np.int32), self.V[i, Y]
+        self.V[i, 0xF] = vy > (0xFF - vx)
+        self.V[i, X] = (self.V[i, X].astype(np.int32) + self.V[i, Y]) & 0xFF
+
+    def _8MM5(self, i, X, Y, N, NN, NNN):  # 8XY5
+        self.V[i, 0xF] = self.V[i, X] >= self.V[i, Y]
+        self.V[i, X] = (self.V[i, X].astype(np.int32) - self.V[i, Y]) & 0xFF
+
+    def _8MM6(self, i, X, Y, N, NN, NNN):  # 8XY6
+        self.V[i, 0xF] = self.V[i, X] & 0x1
+        self.V[i, X] = self.V[i, X] >> 1
+
+    def _8MM7(self, i, X, Y, N, NN, NNN):  # 8XY7
+        self.V[i, 0xF] = self.V[i, Y] >= self.V[i, X]
+        self.V[i, X] = (self.V[i, Y].astype(np.int32) - self.V[i, X]) & 0xFF
+
+    def _8MME(self, i, X, Y, N, NN, NNN):  # 8XYE
+        self.V[i, 0xF] = self.V[i, X] >> 7
+        self.V[i, X] = (self.V[i, X].astype(np.int32) << 1) & 0xFF
+
+    def _9MMM(self, i, X, Y, N, NN, NNN):  # 9XY0
+        self._skip(i, self.V[i, X] != self.V[i, Y])
+
+    def _AMMM(self, i, X, Y, N, NN, NNN):  # ANNN
+        self.I[i] = NNN
+
+    def _BMMM(self, i, X, Y, N, NN, NNN):  # BNNN
+        self.pc[i] = self.V[i, 0x0] + NNN
+
+    def _CMMM(self, i, X, Y, N, NN, NNN):  # CXNN
+        self.V[i, X] = self._random(i) & NN
+
+    def _DMMM(self, i, X, Y, N, NN, NNN):  # DXYN
+        """Batched GFX.draw_sprite: XOR sprites onto screens, flag collisions.
+
+        Sprites are expanded to 16x16 pixel blocks (8xN sprites occupy the
+        upper left 8 columns), clipped to each instance's screen.
+        """
+        x = self.V[i, X].astype(np.int32)
+        y = self.V[i, Y].astype(np.int32)
+        width, height = self.width[i], self.height[i]
+
+        # Instances drawing off-screen keep their previous collision flag
+        drawn = i
+        visible = (x < width) & (y < height)
+        i, N, x, y = i[visible], N[visible], x[visible], y[visible]
+        width, height = width[visible], height[visible]
+
+        # Sprite bytes (N == 0: 16 rows of 2 bytes, else N rows of 1 byte)
+        rows = np.arange(16)
+        wide = (N == 0)[:, None]
+        rows_used = np.where(wide, 16, N[:, None]) > rows
+        I = self.I[i][:, None]
+        hi_addr = np.where(wide, I + 2 * rows, I + rows) & 0xFFF
+        lo_addr = (I + 2 * rows + 1) & 0xFFF
+        hi_byte = np.where(rows_used, self.memory[i[:, None], hi_addr], 0)
+        lo_byte = np.where(rows_used & wide, self.memory[i[:, None], lo_addr], 0)
+        sprite_rows = (hi_byte.astype(np.int32) << 8) | lo_byte
+        pixels = ((sprite_rows[:, :, None] >> (15 - rows)) & 1).astype(bool)
+
+        # Clip to screen and XOR the visible pixels
+        py = y[:, None, None] + rows[None, :, None]
+        px = x[:, None, None] + rows[None, None, :]
+        pixels &= (py < height[:, None, None]) & (px < width[:, None, None])
+        k, r, c = np.nonzero(pixels)
+        inst, py, px = i[k], py[k, r, 0], px[k, 0, c]
+
+        hits = self.screen[inst, py, px]
+        self.screen[inst, py, px] = ~hits
+
+        self.collision_flag[i] = np.bincount(k[hits], minlength=len(i)) > 0
+        self.V[drawn, 0xF] = self.collision_flag[drawn]
+
+    def _EM9E(self, i, X, Y, N, NN, NNN):  # EX9E
+        vx = self.V[i, X]
+        self._skip(i, (vx < 16) & self.keys[i, vx & 0xF])
+
+    def _EMA1(self, i, X, Y, N, NN, NNN):  # EXA1
+        vx = self.V[i, X]
+        self._skip(i, ~((vx < 16) & self.keys[i, vx & 0xF]))
+
+    def _FM07(self, i, X, Y, N, NN, NNN):  # FX07
+        self.V[i, X] = self.delay_timer[i]
+
+    def _FM0A(self, i, X, Y, N, NN, NNN):  # FX0A
+        keys = self.keys[i]
+        pressed = keys.any(axis=1)
+        self.V[i[pressed], X[pressed]] = keys[pressed].argmax(axis=1)
+        self.pc[i[~pressed]] -= 2  # Wait for a key press
+
+    def _FM15(self, i, X, Y, N, NN, NNN):  # FX15
+        self.delay_timer[i] = self.V[i, X]
+
+    def _FM18(self, i, X, Y, N, NN, NNN):  # FX18
+        self.sound_timer[i] = self.V[i, X]
+
+    def _FM1E(self, i, X, Y, N, NN, NNN):  # FX1E
+        overflow = self.I[i] > (0xFFF - self.V[i, X].astype(np.int32))
+        self.V[i, 0xF] = overflow
+        self.I[i] += self.V[i, X] - 0x1000 * overflow
+
+    def _FM29(self, i, X, Y, N, NN, NNN):  # FX29
+        self.I[i] = self.V[i, X].astype(np.int32) * 0x5
+
+    def _FM30(self, i, X, Y, N, NN, NNN):  # FX30
+        self.I[i] = self.V[i, X].astype(np.int32) * 0xA + 16 * 0x5
+
+    def _FM33(self, i, X, Y, N, NN, NNN):  # FX33
+        vx, I = self.V[i, X], self.I[i]
+        self.memory[i, I & 0xFFF] = vx // 100
+        self.memory[i, (I + 1) & 0xFFF] = (vx // 10) % 10
+        self.memory[i, (I + 2) & 0xFFF] = vx % 10
+
+    def _FM55(self, i, X, Y, N, NN, NNN):  # FX55
+        for reg in range(X.max() + 1):
+            j = i[X >= reg]
+            self.memory[j, (self.I[j] + reg) & 0xFFF] = self.V[j, reg]
+
+    def _FM65(self, i, X, Y, N, NN, NNN):  # FX65
+        for reg in range(X.max() + 1):
+            j = i[X >= reg]
+            self.V[j, reg] = self.memory[j, (self.I[j] + reg) & 0xFFF]
+
+    def _FM75(self, i, X, Y, N, NN, NNN):  # FX75
+        for reg in range(min(X.max(), 7) + 1):
+            j = i[X >= reg]
+            self.flags[j, reg] = self.V[j, reg]
+
+    def _FM85(self, i, X, Y, N, NN, NNN):  # FX85
+        for reg in range(min(X.max(), 7) + 1):
+            j = i[X >= reg]
+            self.V[j, reg] = self.flags[j, reg]
+
+    def _NOP(self, i, X, Y, N, NN, NNN):  # Unknown Code
+        pass
+
+
+# ===== QUIRK PROFILES ====================================================== #
+# Batched counterparts of the instructions.QUIRKS handlers, bound to a
+# BatchMachine by load_game.
+class _CosmacVIP(object):
+    def _8MM6(self, i, X, Y, N, NN, NNN):  # 8XY6
+        vy = self.V[i, Y]
+        self.V[i, 0xF] = vy & 0x1
+        self.V[i, X] = vy >> 1
+
+    def _8MME(self, i, X, Y, N, NN, NNN):  # 8XYE
+        vy = self.V[i, Y]
+        self.V[i, 0xF] = vy >> 7
+        self.V[i, X] = (vy.astype(np.int32) << 1) & 0xFF
+
+    def _FM55(self, i, X, Y, N, NN, NNN):  # FX55
+        BatchMachine._FM55(self, i, X, Y, N, NN, NNN)
+        self.I[i] = (self.I[i] + X + 1) & 0xFFFF
+
+    def _FM65(self, i, X, Y, N, NN, NNN):  # FX65
+        BatchMachine._FM65(self, i, X, Y, N, NN, NNN)
+        self.I[i] = (self.I[i] + X + 1) & 0xFFFF
+
+
+class _Chip48(object):
+    def _8MM1(self, i, X, Y, N, NN, NNN):  # 8XY1
+        self.V[i, X] |= self.V[i, Y]
+
+    def _8MM2(self, i, X, Y, N, NN, NNN):  # 8XY2
+        self.V[i, X] &= self.V[i, Y]
+
+    def _8MM3(self, i, X, Y, N, NN, NNN):  # 8XY3
+        self.V[i, X] ^= self.V[i, Y]
+
+    def _BMMM(self, i, X, Y, N, NN, NNN):  # BXNN
+        self.pc[i] = self.V[i, X] + NNN
+
+    def _FM55(self, i, X, Y, N, NN, NNN):  # FX55
+        BatchMachine._FM55(self, i, X, Y, N, NN, NNN)
+        self.I[i] = (self.I[i] + X) & 0xFFFF
+
+    def _FM65(self, i, X, Y, N, NN, NNN):  # FX65
+        BatchMachine._FM65(self, i, X, Y, N, NN, NNN)
+        self.I[i] = (self.I[i] + X) & 0xFFFF
+
+
+class _SuperChip11(_Chip48):
+    _FM55 = BatchMachine._FM55
+    _FM65 = BatchMachine._FM65
+
+    def _00CM(self, i, X, Y, N, NN, NNN):  # 00CN
+        N = np.where(self.width[i] == SCHIP_WIDTH, N, N // 2)
+        BatchMachine._00CM(self, i, X, Y, N, NN, NNN)
+
+    def _00FB(self, i, X, Y, N, NN, NNN):  # 00FB
+        hi = self.width[i] == SCHIP_WIDTH
+        self._scroll(i[hi], 4, "right")
+        self._scroll(i[~hi], 2, "right")
+
+    def _00FC(self, i, X, Y, N, NN, NNN):  # 00FC
+        hi = self.width[i] == SCHIP_WIDTH
+        self._scroll(i[hi], 4, "left")
+        self._scroll(i[~hi], 2, "left")
+
+
+_QUIRKS = {"vip": _CosmacVIP, "chip48": _Chip48, "schip": _SuperChip11}
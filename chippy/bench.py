@@ -0,0 +1,312 @@
+"""Headless benchmarks over the bundled ROM library.
+
+Each ROM is run headless for a fixed number of frames, with a seeded RNG and
+a scripted key sequence, so that runs are comparable between commits. Usage:
+
+    python -m chippy.bench [--frames N] [--output FILE] [--compare FILE] [ROM ...]
+
+Results (instructions executed and frames per second, the decode / execute /
+draw time split and peak traced memory per ROM, per-opcode handler timings
+and the time to import chippy.core / chippy.main in a fresh interpreter) are
+printed and optionally written as JSON. With --compare, ROMs and opcodes
+slower than a previous JSON result by more than --tolerance are reported.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from . import catalog, core, scheduler, translate
+from .instructions import DECODE_TABLE, InstructionSet
+
+FRAMES = 600  # Frames emulated per ROM (10 s of game time)
+SEED = 0
+IMPORTS = ("chippy.core", "chippy.main")  # Modules timed by bench_imports
+
+
+def rom_paths():
+    """Return the (catalog) paths of the bundled ROMs."""
+    return [entry["path"] for entry in catalog.entries()]
+
+
+def rom_name(path):
+    return "/".join(os.path.normpath(path).split(os.sep)[-2:])
+
+
+def key_script(frames, seed=SEED):
+    """Return the hex key held down on each frame (None: no key)."""
+    rng = random.Random(seed)
+    script = []
+    while len(script) < frames:
+        key = rng.choice([None] + list(range(16)))
+        script += [key] * rng.randint(5, 30)
+    return script[:frames]
+
+
+def new_machine(path, seed=SEED):
+    machine = core.Machine(seed=seed)
+    machine.load_game(path)
+    return machine
+
+
+def press_scripted(machine, script, frame):
+    key = script[frame]
+    machine.keyboard.state[: machine.keyboard.HEX_KEYS] = False
+    if key is not None:
+        machine.keyboard.press(key)
+
+
+def run_rom(path, frames=FRAMES, ips=scheduler.IPS, engine="step", seed=SEED):
+    """Time a headless run of a ROM; return instruction and frame rates."""
+    machine = new_machine(path, seed)
+    runner = translate.BlockTranslator(machine) if engine == "blocks" else machine
+    script = key_script(frames, seed)
+    cycles = ips // scheduler.FPS
+
+    executed = 0
+    start = time.perf_counter()
+    for frame in range(frames):
+        press_scripted(machine, script, frame)
+        executed += runner.run(cycles)
+        machine.decrement_timers()
+    elapsed = time.perf_counter() - start
+
+    # Idle loop iterations fast-forwarded are emulated but not executed: ips
+    # measures the interpreter, emulated_ips the emulated time covered.
+    return {
+        "instructions": executed,
+        "seconds": elapsed,
+        "ips": executed / elapsed,
+        "emulated_ips": frames * cycles / elapsed,
+        "fps": frames / elapsed,
+    }
+
+
+def profile_rom(path, frames=FRAMES, ips=scheduler.IPS, seed=SEED):
+    """Split the time of a stepwise run between decode, execute and draw.
+
+    Timing every instruction slows the run down, so the split is best read
+    as fractions. Idle loops are fast-forwarded as in Machine.run, so the
+    instructions timed are those run_rom executes. Peak memory is traced
+    (tracemalloc) over the run.
+    """
+    machine = new_machine(path, seed)
+    script = key_script(frames, seed)
+    cycles = ips // scheduler.FPS
+    clock = time.perf_counter
+    decode = execute = draw = 0.0
+
+    tracemalloc.start()
+    for frame in range(frames):
+        press_scripted(machine, script, frame)
+        remaining = cycles
+        machine.idle = 0
+        while remaining > 0:
+            if machine.keyboard.is_paused() or machine.keyboard.is_exit():
+                break
+
+            t0 = clock()
+            code = machine.fetch_code()
+            machine.pc = (machine.pc + 2) & 0xFFFF
+            handler = machine.decode_table[code]
+            t1 = clock()
+            handler(machine)
+            t2 = clock()
+
+            decode += t1 - t0
+            if handler.__name__ == "_DMMM":
+                draw += t2 - t1
+            else:
+                execute += t2 - t1
+
+            remaining -= 1
+            if machine.idle:
+                remaining %= machine.idle
+                machine.idle = 0
+        machine.decrement_timers()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    total = decode + execute + draw
+    return {
+        "decode": decode / total,
+        "execute": execute / total,
+        "draw": draw / total,
+        "peak_memory": peak,
+    }
+
+
+def example_opcode(name):
+    """Return a representative opcode for an InstructionSet handler name."""
+    operands = {1: "3", 2: "4", 3: "5"}  # X = 3, Y = 4, N = 5 ...
+    symbols = list(name[1:])
+    for pos, sym in enumerate(symbols):
+        if sym == "M":
+            symbols[pos] = operands.get(pos, "0")
+    if name in ("_1MMM", "_2MMM", "_AMMM", "_BMMM"):
+        symbols[1:] = "300"
+    return int("".join(symbols), 16)
+
+
+def bench_opcodes(repeat=2000):
+    """Return the mean time (ns) of a call to each instruction handler."""
+    game = rom_paths()[0]
+    timings = {}
+
+    for name in sorted(InstructionSet.handler_names()):
+        machine = new_machine(game)
+        handler = DECODE_TABLE[example_opcode(name)]
+        machine.I = 0x300
+        if name == "_00EE":
+            machine.stack = [0x200] * repeat
+        if name == "_00FD":
+            machine.keyboard.reset()
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            handler(machine)
+        elapsed = time.perf_counter() - start
+
+        timings[name] = 1e9 * elapsed / repeat
+    return timings
+
+
+def bench_imports(modules=IMPORTS, repeat=5):
+    """Return the best time (s) to import each module in a fresh interpreter.
+
+    Modules that cannot be imported (e.g. chippy.main without pygame) are
+    left out.
+    """
+    code = (
+        "import time; start = time.perf_counter(); import {}; "
+        "print(time.perf_counter() - start)"
+    )
+    env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT="1")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+
+    timings = {}
+    for module in modules:
+        times = []
+        for _ in range(repeat):
+            process = subprocess.run(
+                [sys.executable, "-c", code.format(module)],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                env=env,
+            )
+            if process.returncode:
+                break
+            times.append(float(process.stdout.split()[-1]))
+        if times:
+            timings[module] = min(times)
+    return timings
+
+
+def compare(results, baseline, tolerance):
+    """Return descriptions of results slower than baseline by > tolerance."""
+    regressions = []
+    for rom, result in results["roms"].items():
+        old = baseline.get("roms", {}).get(rom)
+        if old and result["ips"] < old["ips"] * (1 - tolerance):
+            change = result["ips"] / old["ips"] - 1
+            regressions.append("{}: ips {:+.0%}".format(rom, change))
+
+    for module, seconds in results["imports"].items():
+        old = baseline.get("imports", {}).get(module)
+        if old and seconds > old * (1 + tolerance):
+            change = seconds / old - 1
+            regressions.append("import {}: {:+.0%}".format(module, change))
+
+    for name, ns in results["opcodes"].items():
+        old = baseline.get("opcodes", {}).get(name)
+        if old and ns > old * (1 + tolerance):
+            change = ns / old - 1
+            regressions.append("{}: time per call {:+.0%}".format(name, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark chippy headless.")
+    parser.add_argument("roms", nargs="*", help="ROM paths (default: bundled)")
+    parser.add_argument("--frames", type=int, default=FRAMES)
+    parser.add_argument("--ips", type=int, default=scheduler.IPS)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--engine", choices=["step", "blocks"], default="step")
+    parser.add_argument("--output", help="Write JSON results to this file.")
+    parser.add_argument("--compare", help="JSON results to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "frames": args.frames,
+            "ips": args.ips,
+            "seed": args.seed,
+            "engine": args.engine,
+        },
+        "roms": {},
+        "opcodes": {},
+        "imports": {},
+    }
+
+    row = "{:<16} {:>10.0f} {:>8.0f} {:>7.0%} {:>8.0%} {:>5.0%} {:>9.0f}"
+    print("{:<16} {:>10} {:>8} {:>7} {:>8} {:>5} {:>9}".format(
+        "ROM", "IPS", "FPS", "decode", "execute", "draw", "peak KiB"
+    ))
+
+    # Unknown opcodes print; keep that out of the timings and the report
+    with open(os.devnull, "w") as devnull:
+        for path in args.roms or rom_paths():
+            with contextlib.redirect_stdout(devnull):
+                result = run_rom(path, args.frames, args.ips, args.engine, args.seed)
+                result.update(profile_rom(path, args.frames, args.ips, args.seed))
+
+            name = rom_name(path)
+            results["roms"][name] = result
+            print(row.format(
+                name,
+                result["ips"],
+                result["fps"],
+                result["decode"],
+                result["execute"],
+                result["draw"],
+                result["peak_memory"] / 1024.0,
+            ))
+
+        with contextlib.redirect_stdout(devnull):
+            results["opcodes"] = bench_opcodes()
+
+    print("\n{:<8} {:>8}".format("opcode", "ns/call"))
+    for name, ns in sorted(results["opcodes"].items()):
+        print("{:<8} {:>8.0f}".format(name[1:], ns))
+
+    results["imports"] = bench_imports()
+    print("\n{:<16} {:>8}".format("import", "ms"))
+    for module, seconds in sorted(results["imports"].items()):
+        print("{:<16} {:>8.1f}".format(module, 1000 * seconds))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        print("\n{} regression(s)".format(len(regressions)))
+        for regression in regressions:
+            print("  " + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,376 @@
+"""Headless frame capture to PNG sequences, animated GIFs or raw video.
+
+A FrameRecorder is handed the display once per emulated frame. Frames
+identical to the previous one are skipped; the others are sent, as packed
+rows (cf. graphics.PackedGFX), through a bounded queue to an encoder process,
+which upscales and writes them. Capturing a frame therefore costs a row
+comparison and, for changed frames, a queue put. When the encoder falls
+behind and the queue is full, the recorder either drops the frame (policy
+DROP, the default: emulation never waits) or waits for room (BLOCK).
+
+Output formats (at SCHIP resolution times scale, whatever the resolution):
+    png  A directory of PNG images, named after the frame number. Frames not
+         written are identical to the previous image.
+    gif  An animated GIF, frame durations following the frames skipped.
+    raw  Raw 8-bit grey video at fps, e.g. for
+         ffmpeg -f rawvideo -pix_fmt gray -s 512x256 -r 60 -i FILE OUT.mp4
+
+    python -m chippy.capture ROM OUTPUT [--frames N] [--scale N]
+"""
+import multiprocessing
+import os
+import queue
+import struct
+import zlib
+
+import numpy as np
+
+from .graphics import GFX, SCHIP_HEIGHT, SCHIP_WIDTH, PackedGFX
+
+FORMATS = ("png", "gif", "raw")
+DROP = "drop"
+BLOCK = "block"
+
+SCALE = 4  # Output pixels per SCHIP pixel
+QUEUE_SIZE = 120  # Frames waiting for the encoder (two seconds at 60 Hz)
+
+
+def packed_rows(gfx, vote=False):
+    """Return the frame (or vote screen) of a display as a tuple of rows."""
+    if isinstance(gfx, PackedGFX):
+        return tuple(gfx.vote_rows() if vote else gfx.rows)
+    frame = gfx.vote() if vote else gfx.frame
+    data = np.packbits(np.asarray(frame, np.uint8), axis=1)
+    return tuple(int.from_bytes(row.tobytes(), "big") for row in data)
+
+
+class FrameRecorder(object):
+    """Capture a display's frames, encoded by a background process.
+
+    Parameters
+    ----------
+    path : str
+        Output file (gif, raw) or directory (png).
+    format : str, optional
+        One of FORMATS (default: from the extension of path, else png).
+    scale : int
+        Output pixels per SCHIP pixel (low resolution pixels are doubled).
+    fps : int
+        Frame rate of the captured frames.
+    policy : str
+        What to do with a frame when the queue is full: DROP or BLOCK.
+    queue_size : int
+        Frames buffered for the encoder.
+    vote : bool
+        Capture the flicker-reduced vote screen instead of the frame.
+    """
+
+    def __init__(self, path, format=None, scale=SCALE, fps=60, policy=DROP,
+                 queue_size=QUEUE_SIZE, vote=False):
+        if format is None:
+            extension = os.path.splitext(path)[1].lstrip(".").lower()
+            format = extension if extension in FORMATS else "png"
+        if format not in FORMATS:
+            raise ValueError("Unknown capture format: {}".format(format))
+        if policy not in (DROP, BLOCK):
+            raise ValueError("Unknown queue policy: {}".format(policy))
+
+        self.policy = policy
+        self.vote = vote
+        self.last = None  # Rows of the frame last sent
+
+        # Statistics
+        self.frames = 0  # Frames captured
+        self.skipped = 0  # Identical to the previous frame
+        self.dropped = 0  # Queue full
+
+        self.queue = multiprocessing.Queue(queue_size)
+        self.encoder = multiprocessing.Process(
+            target=encode,
+            args=(self.queue, path, format, scale, fps),
+            name="chippy-capture",
+        )
+        self.encoder.daemon = True
+        self.encoder.start()
+
+    def capture(self, gfx):
+        """Capture the current frame of display gfx."""
+        index = self.frames
+        self.frames += 1
+
+        rows = packed_rows(gfx, self.vote)
+        if rows == self.last:
+            self.skipped += 1
+            return
+
+        item = (index, gfx.width, rows)
+        if self.policy == BLOCK:
+            self.queue.put(item)
+        else:
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.dropped += 1
+                return
+        self.last = rows
+
+    def close(self):
+        """Wait for the encoder to write the frames captured, and stop it."""
+        self.queue.put((self.frames, 0, None))
+        self.queue.put(None)
+        self.encoder.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def encode(frames, path, format, scale, fps):
+    """Encoder process: write the (index, width, rows) items of frames.
+
+    An item with rows None marks the end of the capture, at frame index.
+    """
+    writer = WRITERS[format](path, scale, fps)
+    while True:
+        item = frames.get()
+        if item is None:
+            return
+
+        index, width, rows = item
+        if rows is None:
+            writer.close(index)
+        else:
+            writer.write(index, pixels(width, rows, scale))
+
+
+def pixels(width, rows, scale):
+    """Return packed rows as 0 / 1 pixels, upscaled to SCHIP size * scale."""
+    nbytes = width // 8
+    data = b"".join([row.to_bytes(nbytes, "big") for row in rows])
+    bits = np.unpackbits(np.frombuffer(data, np.uint8)).reshape(len(rows), width)
+    factor = scale * SCHIP_WIDTH // width
+    return bits.repeat(factor, axis=0).repeat(factor, axis=1)
+
+
+def grey(image):
+    """Return 0 / 1 pixels as 8-bit grey levels (the display's colours)."""
+    levels = np.array([GFX.OFF_COLOUR, GFX.ON_COLOUR], np.uint8)
+    return levels[image]
+
+
+def png_bytes(image):
+    """Return an 8-bit grey image as a PNG file."""
+    height, width = image.shape
+
+    def chunk(kind, data):
+        crc = zlib.crc32(kind + data) & 0xFFFFFFFF
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+    scanlines = np.hstack([np.zeros([height, 1], np.uint8), image])  # Filter: none
+    return b"".join(
+        [
+            b"\x89PNG\r\n\x1a\n",
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)),
+            chunk(b"IDAT", zlib.compress(scanlines.tobytes(), 6)),
+            chunk(b"IEND", b""),
+        ]
+    )
+
+
+def lzw(indices, min_size=2):
+    """Return the GIF LZW compression of a sequence of colour indices."""
+    clear, end = 1 << min_size, (1 << min_size) + 1
+    out = bytearray()
+    buffer = nbits = 0
+
+    codes = {}
+    size, next_code = min_size + 1, end + 1
+    buffer |= clear << nbits
+    nbits += size
+
+    prefix = None
+    for index in indices:
+        if prefix is None:
+            prefix = index
+            continue
+        code = codes.get((prefix, index))
+        if code is not None:
+            prefix = code
+            continue
+
+        buffer |= prefix << nbits
+        nbits += size
+        if next_code < 4096:
+            codes[(prefix, index)] = next_code
+            next_code += 1
+            if next_code > 1 << size and size < 12:
+                size += 1
+        else:  # Table full: start afresh
+            buffer |= clear << nbits
+            nbits += size
+            codes = {}
+            size, next_code = min_size + 1, end + 1
+        prefix = index
+
+        while nbits >= 8:
+            out.append(buffer & 0xFF)
+            buffer >>= 8
+            nbits -= 8
+
+    if prefix is not None:
+        buffer |= prefix << nbits
+        nbits += size
+    buffer |= end << nbits
+    nbits += size
+    while nbits > 0:
+        out.append(buffer & 0xFF)
+        buffer >>= 8
+        nbits -= 8
+    return bytes(out)
+
+
+class PNGWriter(object):
+    """Write changed frames as PNG images in a directory."""
+
+    def __init__(self, path, scale, fps):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def write(self, index, image):
+        name = os.path.join(self.path, "{:06d}.png".format(index))
+        with open(name, "wb") as png:
+            png.write(png_bytes(grey(image)))
+
+    def close(self, end):
+        pass
+
+
+class GIFWriter(object):
+    """Write frames to an animated GIF.
+
+    Each frame only holds the rectangle that changed since the previous one,
+    drawn over it. A frame is written when the next arrives, as its duration
+    is the time until then.
+    """
+
+    def __init__(self, path, scale, fps):
+        self.file = open(path, "wb")
+        self.fps = fps
+        self.previous = None  # Previous image
+        self.pending = None  # (index, descriptor, data) of the unwritten frame
+
+        height, width = SCHIP_HEIGHT * scale, SCHIP_WIDTH * scale
+        palette = bytes([GFX.OFF_COLOUR] * 3 + [GFX.ON_COLOUR] * 3)
+        self.file.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0xF0, 0, 0))
+        self.file.write(palette)
+        self.file.write(b"\x21\xFF\x0BNETSCAPE2.0\x03\x01\x00\x00\x00")  # Loop
+
+    def write(self, index, image):
+        if self.previous is None:
+            top, left = 0, 0
+            bottom, right = image.shape
+        else:
+            rows, columns = np.nonzero(image != self.previous)
+            if not rows.size:  # Same image (e.g. blank, on a resolution change)
+                return
+            top, bottom = rows.min(), rows.max() + 1
+            left, right = columns.min(), columns.max() + 1
+
+        region = image[top:bottom, left:right]
+        descriptor = struct.pack(
+            "<BHHHHB", 0x2C, left, top, right - left, bottom - top, 0
+        )
+        self.flush(index)
+        self.pending = (index, descriptor, lzw(region.ravel().tolist()))
+        self.previous = image
+
+    def flush(self, end):
+        """Write the pending frame, shown until frame end."""
+        if self.pending is None:
+            return
+
+        start, descriptor, data = self.pending
+        # Durations are in centiseconds: round frame times, not durations
+        delay = round(100.0 * end / self.fps) - round(100.0 * start / self.fps)
+        control = struct.pack("<BBBBHBB", 0x21, 0xF9, 4, 0x04, max(delay, 1), 0, 0)
+
+        blocks = [data[i : i + 255] for i in range(0, len(data), 255)]
+        self.file.write(control + descriptor + b"\x02")
+        self.file.write(b"".join([bytes([len(block)]) + block for block in blocks]))
+        self.file.write(b"\x00")
+        self.pending = None
+
+    def close(self, end):
+        self.flush(end)
+        self.file.write(b"\x3B")
+        self.file.close()
+
+
+class RawWriter(object):
+    """Write every frame as raw 8-bit grey pixels (repeating unchanged ones)."""
+
+    def __init__(self, path, scale, fps):
+        self.file = open(path, "wb")
+        self.previous = None  # Bytes of the previous frame
+        self.next = 0  # Index of the next frame to write
+
+    def fill(self, end):
+        if self.previous is not None:
+            self.file.write(self.previous * (end - self.next))
+        self.next = end
+
+    def write(self, index, image):
+        self.fill(index)
+        self.previous = grey(image).tobytes()
+        self.file.write(self.previous)
+        self.next += 1
+
+    def close(self, end):
+        self.fill(end)
+        self.file.close()
+
+
+WRITERS = {"png": PNGWriter, "gif": GIFWriter, "raw": RawWriter}
+
+
+# Launch from command line
+if __name__ == "__main__":
+    import argparse
+
+    from . import bench, core, scheduler
+
+    parser = argparse.ArgumentParser(description="Capture a headless ROM run.")
+    parser.add_argument("game_path", help="Path to ROM, e.g. games/chip8/BRIX")
+    parser.add_argument("output", help="GIF, raw video file or PNG directory.")
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--scale", type=int, default=SCALE)
+    parser.add_argument("--ips", type=int, default=scheduler.IPS)
+    parser.add_argument("--seed", type=int, default=bench.SEED)
+    parser.add_argument(
+        "--vote",
+        action="store_true",
+        help="Capture the flicker-reduced screen.",
+    )
+    args = parser.parse_args()
+
+    machine = core.Machine(seed=args.seed)
+    machine.load_game(args.game_path)
+    clock = scheduler.Scheduler(machine, args.ips, turbo=True)
+    script = bench.key_script(args.frames, args.seed)
+
+    recorder = FrameRecorder(
+        args.output, args.format, args.scale, policy=BLOCK, vote=args.vote
+    )
+    with recorder:
+        for frame in range(args.frames):
+            bench.press_scripted(machine, script, frame)
+            clock.emulate_frame()
+            recorder.capture(machine.gfx)
+
+    print("{} frames, {} unchanged -> {}".format(
+        recorder.frames, recorder.skipped, args.output
+    ))
@@ -0,0 +1,83 @@
+"""Catalog of the ROMs bundled under chippy/games.
+
+The catalog (games/catalog.json, rebuilt with python -m chippy.catalog) lists
+each ROM's path, name, variant (chip8 / schip), size and SHA-1, so that
+loading and validating a bundled ROM needs no filesystem probing. An entry
+may also name the quirk profile the ROM needs (cf. instructions.QUIRKS), as
+"quirks": such hand edits are kept when the catalog is rebuilt.
+"""
+import hashlib
+import json
+import os
+
+try:
+    from importlib.resources import files as _files
+except ImportError:  # Python < 3.9: the package is a plain directory
+    _files = None
+
+CATALOG = "games/catalog.json"
+VARIANTS = ("chip8", "schip")
+
+_catalog = None  # path -> entry, loaded on first use
+
+
+def package_path(path):
+    """Return the filesystem path of a package resource, e.g. 'games/...'."""
+    if _files is not None:
+        return str(_files(__package__).joinpath(path))
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+
+
+def normalise(game_path):
+    """Return a relative ROM path in catalog form ('games/chip8/BRIX')."""
+    return os.path.normpath(game_path).replace("\\", "/")
+
+
+def build():
+    """Scan the bundled ROMs and write the catalog; return its entries."""
+    quirks = {}
+    if os.path.exists(package_path(CATALOG)):
+        quirks = {e["path"]: e["quirks"] for e in entries() if "quirks" in e}
+
+    catalog = []
+    for variant in VARIANTS:
+        directory = package_path("games/" + variant)
+        for name in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, name), "rb") as rom:
+                data = rom.read()
+            entry = {
+                "path": "games/{}/{}".format(variant, name),
+                "name": name,
+                "variant": variant,
+                "size": len(data),
+                "sha1": hashlib.sha1(data).hexdigest(),
+            }
+            if entry["path"] in quirks:
+                entry["quirks"] = quirks[entry["path"]]
+            catalog.append(entry)
+
+    with open(package_path(CATALOG), "w") as catalog_file:
+        json.dump(catalog, catalog_file, indent=1)
+        catalog_file.write("\n")
+    return catalog
+
+
+def entries():
+    """Return the catalog entries (bundled ROMs), chip8 then schip."""
+    global _catalog
+    if _catalog is None:
+        with open(package_path(CATALOG)) as catalog:
+            _catalog = {entry["path"]: entry for entry in json.load(catalog)}
+    return list(_catalog.values())
+
+
+def lookup(game_path):
+    """Return the catalog entry of a relative ROM path, or None."""
+    if _catalog is None:
+        entries()
+    return _catalog.get(normalise(game_path))
+
+
+# Rebuild from command line
+if __name__ == "__main__":
+    print("{} ROMs -> {}".format(len(build()), package_path(CATALOG)))
@@ -1,10 +1,12 @@
 import os
+import random
 
 import numpy as np
-import pkg_resources
 
-from . import graphics, keyboard
-from .instructions import InstructionSet, Opcode
+from . import catalog
+from .backends import HeadlessBackend
+from .debugger import Debugger
+from .instructions import Opcode, decode_table
 
 FONTSET = [
     0xF0, 0x90, 0x90, 0x90, 0xF0,  # 0 
@@ -36,42 +38,120 @@ FONTSET = [
 ]
 
 
+class CountingRandom(random.Random):
+    """Random number generator counting its state changes (cf. state.Rewind).
+
+    changes grows whenever numbers are drawn or the state is reseeded or
+    restored, so that the (large) state only needs reading when it moved.
+    """
+
+    changes = 0
+
+    def seed(self, *args, **kwargs):
+        self.changes += 1
+        super(CountingRandom, self).seed(*args, **kwargs)
+
+    def setstate(self, state):
+        self.changes += 1
+        super(CountingRandom, self).setstate(state)
+
+    def getrandbits(self, k):
+        self.changes += 1
+        return super(CountingRandom, self).getrandbits(k)
+
+
 class Machine(object):
     MEMORY = 4096            # Total machine memory (bytes)
     PC_START = 512           # Program counter start
     MAX_FILE_SIZE = 3584     # Limit on ROM size
     REGISTERS = 16           # Number of registers
 
-    def __init__(self):
+    # Machine state is held in plain ints and bytearrays (rather than NumPy
+    # scalars) for fast single value arithmetic. Registers are 8-bit and I,
+    # pc are 16-bit: handlers mask (& 0xFF / & 0xFFFF) on overflow.
+    __slots__ = (
+        "game",
+        "I",
+        "pc",
+        "delay_timer",
+        "sound_timer",
+        "memory",
+        "memory_view",
+        "V",
+        "stack",
+        "decode_table",
+        "gfx",
+        "keyboard",
+        "rng",
+        "idle",
+        "debugger",
+        "quirks",
+        "flags",
+    )
+
+    def __init__(self, backend=None, seed=None):
         self.game = ""                          # Game title
 
-        self.I = np.uint16(0)                   # Index register
-        self.pc = np.uint16(Machine.PC_START)   # Program counter
-        self.delay_timer = np.uint16(0)         # Delay timer
-        self.sound_timer = np.uint16(0)         # Sound timer
+        self.I = 0                              # Index register
+        self.pc = Machine.PC_START              # Program counter
+        self.delay_timer = 0                    # Delay timer
+        self.sound_timer = 0                    # Sound timer
 
-        self.memory = np.zeros(Machine.MEMORY, np.uint8)  # 4K Emulated memory
-        self.V = np.zeros(Machine.REGISTERS, np.uint8)    # 8-bit registers
+        self.clean_memory()                             # 4K Emulated memory
+        self.V = bytearray(Machine.REGISTERS)           # 8-bit registers
         self.stack = []                                 # Stack for subroutines
+        self.flags = bytearray(8)                       # SCHIP user flags
+
+        # Opcode -> handler lookup (shared between machines), by quirk profile
+        self.quirks = None
+        self.decode_table = decode_table()
 
-        # UI handling
-        self.gfx = graphics.GFX()
-        self.keyboard = keyboard.HexKeyboard()
+        # UI handling (headless unless a display / input backend is given)
+        backend = backend if backend is not None else HeadlessBackend()
+        self.gfx = backend.create_gfx()
+        self.keyboard = backend.create_keyboard()
+
+        # Random numbers (CXNN), seedable for reproducible runs
+        self.rng = CountingRandom(seed)
+
+        # Length of the idle loop just closed (set by handlers, cf. run)
+        self.idle = 0
+
+        # Breakpoints and watchpoints (created on first use, cf. debug)
+        self.debugger = None
 
     def reset(self):
-        self.I = np.uint16(0)
-        self.pc = np.uint16(Machine.PC_START)
-        self.delay_timer = np.uint16(0)
-        self.sound_timer = np.uint16(0)
+        self.I = 0
+        self.pc = Machine.PC_START
+        self.delay_timer = 0
+        self.sound_timer = 0
         self.stack = []
-        self.V = np.zeros(Machine.REGISTERS, np.uint8)
+        self.V = bytearray(Machine.REGISTERS)
         self.gfx.clear()
         self.keyboard.reset()
 
+    def seed(self, seed):
+        """Reseed the machine's random number generator."""
+        self.rng.seed(seed)
+
+    def debug(self):
+        """Return the machine's debugger (cf. chippy.debugger.Debugger)."""
+        if self.debugger is None:
+            self.debugger = Debugger(self)
+        return self.debugger
+
     def clean_memory(self):
-        self.memory = np.zeros(Machine.MEMORY, np.uint8)
+        self.memory = bytearray(Machine.MEMORY)
+        self.memory_view = np.frombuffer(self.memory, np.uint8)  # Zero-copy
+
+    def load_game(self, game_path, quirks=None):
+        """Load a ROM, running it with a quirk profile (cf. QUIRKS).
 
-    def load_game(self, game_path):
+        The profile defaults to the one the catalog gives bundled ROMs, if
+        any, else to the default instruction set. The debugger's watchpoints
+        are re-armed on the new decode table; profilers and tracers must be
+        attached again.
+        """
         PC0 = Machine.PC_START
         MAX_FILE_SIZE = Machine.MAX_FILE_SIZE
         NUMBER_OF_FONTS = len(FONTSET)
@@ -80,15 +160,25 @@ class Machine(object):
         self.clean_memory()
         self.reset()
 
-        # Get absolute path to game
+        # Get absolute path to game (and its size, for bundled ROMs)
+        entry = None
         if not os.path.isabs(game_path):
-            game_path = pkg_resources.resource_filename(__name__, game_path)
+            entry = catalog.lookup(game_path)
+            game_path = catalog.package_path(catalog.normalise(game_path))
+
+        # Select the instruction set
+        if quirks is None and entry is not None:
+            quirks = entry.get("quirks")
+        self.decode_table = decode_table(quirks)
+        self.quirks = quirks
+        if self.debugger is not None:
+            self.debugger.reload()
 
         # Set game name
         self.game = os.path.basename(os.path.splitext(game_path)[0]).upper()
 
         # Determine file size
-        file_size = os.path.getsize(game_path)
+        file_size = entry["size"] if entry else os.path.getsize(game_path)
         if file_size > MAX_FILE_SIZE:
             print("ROM cannot exceed {} bytes.".format(MAX_FILE_SIZE))
             return
@@ -107,6 +197,9 @@ class Machine(object):
         rh_op = self.memory[self.pc + 1]
         return Opcode.from_pair(lh_op, rh_op)
 
+    def fetch_code(self):
+        return (self.memory[self.pc] << 8) | self.memory[self.pc + 1]
+
     def emulate_cycle(self):
         if self.keyboard.is_reset():
             self.reset()
@@ -115,17 +208,41 @@ class Machine(object):
             return
 
         else:
-            opcode = self.fetch_opcode()             # Fetch
-            self.pc += 2
-            instruction = InstructionSet(opcode)     # Decode
-            instruction.execute(self)                # Execute
+            code = self.fetch_code()                 # Fetch
+            self.pc = (self.pc + 2) & 0xFFFF
+            self.decode_table[code](self)            # Decode & execute
+
+    def run(self, cycles):
+        """Emulate cycles instructions.
+
+        Idle loops (a timer wait, key poll or FX0A wait) are fast-forwarded:
+        since their iterations do not change the machine until the timers
+        tick or a key event arrives, which only happen between calls, whole
+        iterations left in the budget are skipped rather than emulated.
+        Returns the number of instructions actually executed.
+        """
+        if self.debugger is not None and self.debugger.armed:
+            return self.debugger.run(cycles)
+
+        executed = cycles
+        self.idle = 0
+        while cycles > 0:
+            self.emulate_cycle()
+            cycles -= 1
+            if self.idle:
+                executed -= cycles - cycles % self.idle
+                cycles %= self.idle
+                self.idle = 0
+        return executed
 
     def decrement_timers(self):
         if self.keyboard.is_paused() or self.keyboard.is_exit():
             return
 
         # Update timers
-        self.delay_timer -= np.uint16(self.delay_timer > 0)
-        self.sound_timer -= np.uint16(self.sound_timer > 0)
+        if self.delay_timer > 0:
+            self.delay_timer -= 1
+        if self.sound_timer > 0:
+            self.sound_timer -= 1
         # if(self.sound_timer == 1):
         #     print('\a')
@@ -0,0 +1,203 @@
+"""Breakpoints and memory watchpoints.
+
+A machine's debugger (Machine.debug()) stops execution when the program
+counter reaches a breakpoint, or when an instruction reads or writes a
+watched memory address, and pauses the machine (as the PAUSE key does) until
+resumed. Only the instructions that access memory are instrumented: while
+watchpoints are set, the machine's decode table is swapped for one in which
+FX33, FX55 (writes), FX65, DXYN (reads) and FX1E (I moved into a watched
+range) check an address bitmap after executing. Breakpoints are a bitmap
+indexed by PC.
+
+Nothing is checked while no breakpoint or watchpoint is set: the machine
+(or block translator) looks at its debugger once per batch of cycles and
+only hands the batch to Debugger.run, which executes stepwise, when armed.
+"""
+import collections
+import functools
+
+from .instructions import WrappedDecodeTable, decode_table
+
+BREAK = "break"
+READ = "read"
+WRITE = "write"
+INDEX = "index"
+
+MEMORY = 4096
+
+# A stop: its kind, the address hit and the pc of the instruction
+Hit = collections.namedtuple("Hit", "kind address pc")
+
+# Memory accessing opcodes (cf. InstructionSet), as {mask: (kind, nbytes)}
+# with nbytes(instruction, machine) the bytes accessed from I.
+_ACCESSES = {
+    "_FM33": (WRITE, lambda instruction, machine: 3),
+    "_FM55": (WRITE, lambda instruction, machine: instruction.X + 1),
+    "_FM65": (READ, lambda instruction, machine: instruction.X + 1),
+    "_DMMM": (
+        READ,
+        lambda instruction, machine: instruction.N or 2 * machine.gfx.MAX_HEIGHT,
+    ),
+}
+
+
+class Debugger(object):
+    """Breakpoints and watchpoints of a machine.
+
+    Parameters
+    ----------
+    machine : core.Machine
+        The machine debugged.
+    """
+
+    def __init__(self, machine):
+        self.machine = machine
+        self.breakpoints = bytearray(MEMORY)  # pc -> set
+        self.reads = bytearray(MEMORY)  # address -> watched
+        self.writes = bytearray(MEMORY)
+
+        self.watching = False  # Instrumented decode table swapped in
+        self.armed = False  # Any breakpoint or watchpoint set
+        self.hit = None  # Last stop
+        self.stopped = False  # Stopped during the current batch
+        self.resume_pc = None  # Breakpoint to step over when resuming
+
+    def add_breakpoint(self, pc):
+        self.breakpoints[pc] = 1
+        self.update()
+
+    def remove_breakpoint(self, pc):
+        self.breakpoints[pc] = 0
+        self.update()
+
+    def watch(self, start, stop=None, read=False, write=True):
+        """Watch memory range [start, stop) (default: address start)."""
+        stop = start + 1 if stop is None else stop
+        if read:
+            self.reads[start:stop] = b"\x01" * (stop - start)
+        if write:
+            self.writes[start:stop] = b"\x01" * (stop - start)
+        self.update()
+
+    def unwatch(self, start, stop=None):
+        stop = start + 1 if stop is None else stop
+        self.reads[start:stop] = bytes(stop - start)
+        self.writes[start:stop] = bytes(stop - start)
+        self.update()
+
+    def clear(self):
+        """Remove every breakpoint and watchpoint."""
+        for bitmap in (self.breakpoints, self.reads, self.writes):
+            bitmap[:] = bytes(MEMORY)
+        self.update()
+
+    def update(self):
+        """Swap the instrumented decode table in or out, as needed."""
+        watching = any(self.reads) or any(self.writes)
+        if watching != self.watching:
+            machine = self.machine
+            if watching:  # Instrument the machine's instruction set
+                instruction_set = machine.decode_table.instruction_set
+                machine.decode_table = WrappedDecodeTable(self.wrap, instruction_set)
+            else:
+                machine.decode_table = decode_table(machine.quirks)
+            self.watching = watching
+        self.armed = watching or any(self.breakpoints)
+
+    def reload(self):
+        """Re-instrument the machine after its decode table was replaced.
+
+        Breakpoints and watchpoints are kept; a pending stop is forgotten.
+        """
+        self.watching = False
+        self.hit = None
+        self.stopped = False
+        self.resume_pc = None
+        self.update()
+
+    def wrap(self, handler):
+        """Return handler wrapped to check watchpoints, if it accesses memory."""
+        name = handler.__name__
+        instruction = handler.__self__
+
+        if name == "_FM1E":
+
+            @functools.wraps(handler)
+            def checked(machine):
+                handler(machine)
+                I = machine.I
+                if I < MEMORY and (self.reads[I] or self.writes[I]):
+                    self.stop(INDEX, I, machine.pc - 2)
+
+            return checked
+
+        if name not in _ACCESSES:
+            return handler
+
+        kind, nbytes = _ACCESSES[name]
+        watched = self.reads if kind == READ else self.writes
+
+        @functools.wraps(handler)
+        def checked(machine):
+            start = machine.I
+            stop = start + nbytes(instruction, machine)
+            handler(machine)
+            address = watched.find(1, start, stop)
+            if address >= 0:
+                self.stop(kind, address, machine.pc - 2)
+
+        return checked
+
+    def stop(self, kind, address, pc):
+        """Record a hit and pause the machine."""
+        self.hit = Hit(kind, address, pc)
+        self.stopped = True
+        keyboard = self.machine.keyboard
+        if not keyboard.is_paused():
+            keyboard.set_pause()
+
+    def resume(self):
+        """Unpause the machine after a stop."""
+        keyboard = self.machine.keyboard
+        if keyboard.is_paused():
+            keyboard.set_pause()
+
+    def run(self, cycles, step=None):
+        """Emulate up to cycles instructions stepwise, stopping on a hit.
+
+        Returns the number of instructions actually executed.
+
+        Parameters
+        ----------
+        cycles : int
+            Instructions to emulate.
+        step : callable, optional
+            Emulates one cycle (default: the machine's emulate_cycle).
+        """
+        machine = self.machine
+        keyboard = machine.keyboard
+        step = step if step is not None else machine.emulate_cycle
+        breakpoints = self.breakpoints
+
+        executed = cycles
+        self.stopped = False
+        machine.idle = 0
+        while cycles > 0:
+            pc = machine.pc
+            if breakpoints[pc & 0xFFF] and not keyboard.is_paused():
+                if pc == self.resume_pc:  # Resuming: execute it this time
+                    self.resume_pc = None
+                else:
+                    self.resume_pc = pc
+                    self.stop(BREAK, pc, pc)
+                    return executed - cycles
+
+            step()
+            cycles -= 1
+            if self.stopped:
+                return executed - cycles
+            if machine.idle:  # Fast-forward idle loops, as Machine.run
+                executed -= cycles - cycles % machine.idle
+                cycles %= machine.idle
+                machine.idle = 0
+        return executed
@@ -0,0 +1,420 @@
+"""Parallel state-space exploration of ROMs, e.g. to find crashes.
+
+Starting from a freshly loaded ROM, the explorer repeatedly takes a state
+from its frontier and forks one successor per input (no key, or one hex key
+held) by restoring the state's snapshot and emulating a few frames. States
+are deduplicated by a hash of memory, registers, stack, timers and screen;
+new ones join the frontier (breadth first). Successors are computed by
+worker processes, in batches.
+
+Snapshots are compact tuples: memory is stored as the bytes that differ from
+the ROM image each worker holds, and the screen as packed rows (cf.
+graphics.PackedGFX). The memory hash is incremental: a sum of per-address
+hashes, updated by the only instructions writing memory (FX33, FX55), so
+hashing a state does not read its 4K of memory.
+
+Crashes end a path and are reported with the inputs reaching them: a return
+(00EE) with an empty stack, a call (2NNN) overflowing the stack, unknown
+opcodes (_NOP), writes (FX33, FX55) past the end of memory, the program
+counter leaving memory and any other error an instruction raises (reported
+with its opcode and handler). The random number generator is reseeded from
+the state before each step, so paths replay deterministically (see replay).
+
+    python -m chippy.explore ROM [--states N] [--depth N] [--workers N]
+"""
+import collections
+import functools
+import multiprocessing
+import os
+
+import numpy as np
+
+from . import core, scheduler, state
+from .graphics import SCHIP_WIDTH
+from .instructions import WrappedDecodeTable
+
+FRAMES = 6  # Frames emulated per step (input held)
+ACTIONS = (None,) + tuple(range(16))  # No key, or one hex key held
+BATCH = 32  # States per worker task
+
+_MASK = 0xFFFFFFFFFFFFFFFF
+
+_expander = None  # Per worker
+
+
+class Crash(Exception):
+    """A crash state reached while exploring."""
+
+
+def address_hash(address, value):
+    """Return the 64-bit hash of a memory byte (splitmix64 finaliser)."""
+    x = (((address << 8) | value) * 0x9E3779B97F4A7C15) & _MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK
+    return x ^ (x >> 31)
+
+
+def memory_hash(memory):
+    return sum(address_hash(a, value) for a, value in enumerate(memory)) & _MASK
+
+
+class Expander(object):
+    """Fork successors of states of a ROM, on a machine of its own.
+
+    Parameters
+    ----------
+    game_path : str
+        ROM explored.
+    quirks : str, optional
+        Quirk profile, cf. Machine.load_game.
+    frames : int
+        Frames emulated per step.
+    ips : int
+        Instructions per second.
+    """
+
+    def __init__(self, game_path, quirks=None, frames=FRAMES, ips=scheduler.IPS):
+        machine = core.Machine()
+        machine.load_game(game_path, quirks)
+        machine.decode_table = WrappedDecodeTable(
+            self.wrap, machine.decode_table.instruction_set
+        )
+        self.machine = machine
+        self.frames = frames
+        self.cycles = ips // scheduler.FPS
+
+        self.base = np.array(machine.memory_view)  # ROM image
+        self.base_bytes = self.base.tobytes()
+        self.memory_hash = memory_hash(machine.memory)
+        self.seen = set()  # Keys of the states sent (skipped if met again)
+
+    def wrap(self, handler):
+        """Return handler wrapped to detect crashes or track memory writes."""
+        name = handler.__name__
+        instruction = handler.__self__
+
+        if name == "_NOP":
+
+            @functools.wraps(handler)
+            def checked(machine):
+                raise Crash("unknown opcode {}".format(instruction.opcode.as_str()))
+
+        elif name == "_00EE":
+
+            @functools.wraps(handler)
+            def checked(machine):
+                if not machine.stack:
+                    raise Crash("return with an empty stack")
+                handler(machine)
+
+        elif name == "_2MMM":
+
+            @functools.wraps(handler)
+            def checked(machine):
+                if len(machine.stack) >= state.STACK_SIZE:
+                    raise Crash("stack overflow")
+                handler(machine)
+
+        elif name in ("_FM33", "_FM55"):
+            nbytes = 3 if name == "_FM33" else instruction.X + 1
+
+            @functools.wraps(handler)
+            def checked(machine):
+                memory, start = machine.memory, machine.I
+                if start + nbytes > len(memory):
+                    raise Crash("write past end of memory")
+                old = memory[start : start + nbytes]
+                handler(machine)
+                new = memory[start : start + nbytes]
+                total = self.memory_hash
+                for a, (before, after) in enumerate(zip(old, new), start):
+                    if before != after:
+                        total += address_hash(a, after) - address_hash(a, before)
+                self.memory_hash = total & _MASK
+
+        else:
+            checked = handler
+
+        code = instruction.opcode.as_str()
+        end = core.Machine.MEMORY - 1  # Past the last address an opcode fits at
+
+        @functools.wraps(handler)
+        def stepped(machine):
+            try:
+                checked(machine)
+            except Crash:
+                raise
+            except Exception as error:
+                raise Crash(
+                    "{} ({}) raised {}: {}".format(
+                        code, name, type(error).__name__, error
+                    )
+                )
+            if machine.pc >= end:
+                raise Crash("program counter out of memory")
+
+        return stepped
+
+    def snapshot(self):
+        """Return the machine state (all that affects its future) as a tuple."""
+        machine = self.machine
+        changed = np.flatnonzero(machine.memory_view != self.base).astype(np.uint16)
+        return (
+            self.memory_hash,
+            changed.tobytes(),
+            machine.memory_view[changed].tobytes(),
+            bytes(machine.V),
+            machine.I,
+            machine.pc,
+            tuple(machine.stack),
+            machine.delay_timer,
+            machine.sound_timer,
+            machine.gfx.width,
+            tuple(machine.gfx.rows),
+            bytes(machine.flags),
+        )
+
+    def restore(self, snapshot):
+        machine = self.machine
+        (
+            self.memory_hash,
+            changed,
+            values,
+            V,
+            machine.I,
+            machine.pc,
+            stack,
+            machine.delay_timer,
+            machine.sound_timer,
+            width,
+            rows,
+            flags,
+        ) = snapshot
+
+        machine.memory[:] = self.base_bytes
+        machine.memory_view[np.frombuffer(changed, np.uint16)] = np.frombuffer(
+            values, np.uint8
+        )
+        machine.V = bytearray(V)
+        machine.stack = list(stack)
+        machine.flags = bytearray(flags)
+        machine.keyboard.reset()
+
+        gfx = machine.gfx
+        if gfx.width != width:
+            gfx.set_resolution("high" if width == SCHIP_WIDTH else "low")
+        gfx.rows = list(rows)
+
+    def key(self):
+        """Return the hash identifying the machine state."""
+        machine = self.machine
+        return hash(
+            (
+                self.memory_hash,
+                int.from_bytes(machine.V, "little"),
+                machine.I,
+                machine.pc,
+                tuple(machine.stack),
+                machine.delay_timer,
+                machine.sound_timer,
+                hash(tuple(machine.gfx.rows)),
+                int.from_bytes(machine.flags, "little"),
+            )
+        )
+
+    def step(self, action):
+        """Emulate one step with action held; return a crash message or None."""
+        machine = self.machine
+        if action is not None:
+            machine.keyboard.press(action)
+        try:
+            for _ in range(self.frames):
+                machine.run(self.cycles)
+                machine.decrement_timers()
+        except Crash as crash:
+            return str(crash)
+        return None
+
+    def expand(self, batch):
+        """Return the successors of a batch of (key, snapshot).
+
+        Successors are (parent key, action, key, screen hash, snapshot or
+        crash message); those already returned by this worker are left out.
+        """
+        machine = self.machine
+        successors = []
+        for parent, snapshot in batch:
+            for i, action in enumerate(ACTIONS):
+                self.restore(snapshot)
+                machine.seed((parent + i) & _MASK)
+                crash = self.step(action)
+                if crash is None and not machine.keyboard.is_exit():
+                    key, result = self.key(), None
+                else:  # Terminal state: not to be confused with a live one
+                    key, result = hash((self.key(), -1)), crash or "exit"
+                if key in self.seen:
+                    continue
+
+                self.seen.add(key)
+                if result is None:
+                    result = self.snapshot()
+                screen = hash((machine.gfx.width, tuple(machine.gfx.rows)))
+                successors.append((parent, action, key, screen, result))
+        return successors
+
+
+def start_worker(game_path, quirks, frames, ips):
+    """Pool initializer: create the worker's expander."""
+    global _expander
+    _expander = Expander(game_path, quirks, frames, ips)
+
+
+def expand(batch):
+    return _expander.expand(batch)
+
+
+class Explorer(object):
+    """Breadth first exploration of the states of a ROM.
+
+    Parameters
+    ----------
+    game_path : str
+        ROM explored.
+    quirks : str, optional
+        Quirk profile, cf. Machine.load_game.
+    frames : int
+        Frames emulated per step.
+    ips : int
+        Instructions per second.
+    """
+
+    def __init__(self, game_path, quirks=None, frames=FRAMES, ips=scheduler.IPS):
+        self.settings = (game_path, quirks, frames, ips)
+        root = Expander(*self.settings)
+        self.root = root.key()
+
+        self.frontier = collections.deque([(self.root, root.snapshot())])
+        self.parents = {self.root: None}  # key -> (parent key, action)
+        self.levels = {self.root: 0}  # key -> step reached at
+        self.screens = set()  # Screen hashes seen
+        self.crashes = []  # (message, key), in order found
+        self.expanded = 0  # States expanded
+
+    def path(self, key):
+        """Return the actions (None or hex key, per step) reaching a state."""
+        actions = []
+        while self.parents[key] is not None:
+            key, action = self.parents[key]
+            actions.append(action)
+        return actions[::-1]
+
+    def run(self, states=100000, depth=None, workers=None, batch=BATCH):
+        """Explore until states are known, or the frontier runs out.
+
+        Parameters
+        ----------
+        states : int
+            Number of distinct states to stop at.
+        depth : int, optional
+            Deepest step explored (default: unlimited).
+        workers : int, optional
+            Worker processes (default: one per core; 1: no pool).
+        batch : int
+            States per worker task.
+        """
+        workers = workers or os.cpu_count()
+        pool = None
+        if workers > 1:
+            pool = multiprocessing.Pool(workers, start_worker, self.settings)
+            mapper = pool.imap_unordered
+        else:
+            start_worker(*self.settings)
+            mapper = map
+
+        try:
+            while self.frontier and len(self.parents) < states:
+                # Expand (at most) a task of batch states per worker
+                tasks = []
+                while self.frontier and len(tasks) < 4 * workers:
+                    task = []
+                    while self.frontier and len(task) < batch:
+                        key, snapshot = self.frontier.popleft()
+                        if depth is None or self.levels[key] < depth:
+                            task.append((key, snapshot))
+                    if task:
+                        tasks.append(task)
+
+                for successors in mapper(expand, tasks):
+                    for parent, action, key, screen, result in successors:
+                        self.add(parent, action, key, screen, result)
+                self.expanded += sum(len(task) for task in tasks)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def add(self, parent, action, key, screen, result):
+        """Record a successor (cf. Expander.expand), unless already known."""
+        if key in self.parents:
+            return
+
+        self.parents[key] = (parent, action)
+        self.levels[key] = self.levels[parent] + 1
+        self.screens.add(screen)
+        if isinstance(result, tuple):
+            self.frontier.append((key, result))
+        elif result != "exit":
+            self.crashes.append((result, key))
+
+    def report(self):
+        """Return a summary of the exploration and the crashes found."""
+        lines = [
+            "{} states, {} expanded, {} screens, {} crashes".format(
+                len(self.parents), self.expanded, len(self.screens), len(self.crashes)
+            )
+        ]
+        for message, key in self.crashes:
+            lines.append("{}: {}".format(message, format_path(self.path(key))))
+        return "\n".join(lines)
+
+
+def format_path(actions):
+    """Return actions as text, e.g. '- - 5 5 -' (- for no key)."""
+    return " ".join(["-" if key is None else "{:X}".format(key) for key in actions])
+
+
+def replay(game_path, actions, quirks=None, frames=FRAMES, ips=scheduler.IPS):
+    """Replay a path from the explorer; return the crash message or None."""
+    expander = Expander(game_path, quirks, frames, ips)
+    machine = expander.machine
+    for action in actions:
+        machine.keyboard.reset()
+        machine.seed((expander.key() + ACTIONS.index(action)) & _MASK)
+        crash = expander.step(action)
+        if crash is not None:
+            return crash
+    return None
+
+
+# Launch from command line
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Explore the states of a ROM.")
+    parser.add_argument("game_path", help="Path to ROM, e.g. games/chip8/BRIX")
+    parser.add_argument("--states", type=int, default=100000)
+    parser.add_argument("--depth", type=int, help="Deepest step explored.")
+    parser.add_argument("--frames", type=int, default=FRAMES, help="Frames per step.")
+    parser.add_argument("--ips", type=int, default=scheduler.IPS)
+    parser.add_argument("--quirks", help="Quirk profile (cf. instructions.QUIRKS).")
+    parser.add_argument("--workers", type=int, help="Default: one per core.")
+    args = parser.parse_args()
+
+    explorer = Explorer(args.game_path, args.quirks, args.frames, args.ips)
+    start = time.perf_counter()
+    explorer.run(args.states, args.depth, args.workers)
+    elapsed = time.perf_counter() - start
+
+    print(explorer.report())
+    print("{:.0f} states/s".format(len(explorer.parents) / elapsed))
@@ -0,0 +1,157 @@
+"""Parallel headless runs of ROMs (and seed / input variants of them).
+
+Jobs are spread over a multiprocessing pool. Each job runs a ROM headless
+for a number of frames, with an RNG seed and a scripted key sequence (cf.
+bench.key_script) given by its variant number, and returns the instruction
+count, a hash of the final machine state and a hash of the screen on each
+frame. Results are appended to a JSON lines file as they arrive; rerunning
+with the same file skips the jobs already in it, so sweeps can be resumed.
+
+    python -m chippy.farm [ROM ...] [--variants N] [--frames N] [--output FILE]
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import zlib
+
+from . import bench, core, scheduler, state, translate
+
+FRAMES = 600
+
+_loaded = {}  # ROM path -> (machine, state after loading), per worker
+
+
+def quiet_worker():
+    """Pool initializer: drop the interpreter's output (unknown opcodes)."""
+    sys.stdout = open(os.devnull, "w")
+
+
+def job_id(rom, variant):
+    return "{}:{}".format(bench.rom_name(rom), variant)
+
+
+def machine_for(rom):
+    """Return a worker's machine for rom, reset to its freshly loaded state."""
+    if rom not in _loaded:
+        machine = core.Machine()
+        machine.load_game(rom)
+        _loaded[rom] = (machine, state.dumps(machine))
+
+    machine, loaded = _loaded[rom]
+    state.loads(machine, loaded)
+    return machine
+
+
+def screen_hash(gfx):
+    """Return a CRC of the (packed) frame."""
+    nbytes = gfx.width // 8
+    return zlib.crc32(b"".join([row.to_bytes(nbytes, "big") for row in gfx.rows]))
+
+
+def run_job(job):
+    """Run a (rom, variant, frames, ips, blocks) job; return its result."""
+    rom, variant, frames, ips, blocks = job
+    machine = machine_for(rom)
+    machine.seed(variant)
+    engine = translate.BlockTranslator(machine) if blocks else None
+    clock = scheduler.Scheduler(machine, ips, turbo=True, engine=engine)
+    script = bench.key_script(frames, variant)
+
+    screens = []
+    for frame in range(frames):
+        bench.press_scripted(machine, script, frame)
+        clock.emulate_frame()
+        screens.append("{:08x}".format(screen_hash(machine.gfx)))
+
+    return {
+        "id": job_id(rom, variant),
+        "rom": bench.rom_name(rom),
+        "variant": variant,
+        "frames": frames,
+        "instructions": clock.instructions,
+        "state": hashlib.sha1(state.dumps(machine)).hexdigest(),
+        "screens": "".join(screens),
+    }
+
+
+def completed(path):
+    """Return the ids of the jobs in a results file (dropping a torn line)."""
+    if not os.path.exists(path):
+        return set()
+
+    with open(path, "rb+") as results:
+        data = results.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):  # Interrupted while writing the last result
+            results.truncate(end)
+
+    return set(json.loads(line)["id"] for line in data[:end].splitlines())
+
+
+def run(roms, variants=1, frames=FRAMES, output="farm.jsonl", workers=None,
+        ips=scheduler.IPS, blocks=False):
+    """Run the jobs not yet in output; return the number run."""
+    done = completed(output)
+    jobs = [
+        (rom, variant, frames, ips, blocks)
+        for rom in roms
+        for variant in range(variants)
+        if job_id(rom, variant) not in done
+    ]
+    if not jobs:
+        return 0
+
+    workers = workers or os.cpu_count()
+    chunksize = max(1, min(16, len(jobs) // (4 * workers)))
+    pool = multiprocessing.Pool(workers, quiet_worker)
+    try:
+        with open(output, "a") as results:
+            for result in pool.imap_unordered(run_job, jobs, chunksize):
+                results.write(json.dumps(result, sort_keys=True) + "\n")
+                results.flush()
+    finally:
+        pool.terminate()
+        pool.join()
+    return len(jobs)
+
+
+# Launch from command line
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Run ROMs headless in parallel.")
+    parser.add_argument("roms", nargs="*", help="ROM paths (default: bundled)")
+    parser.add_argument(
+        "--variants",
+        type=int,
+        default=1,
+        help="Seed / input variants per ROM.",
+    )
+    parser.add_argument("--frames", type=int, default=FRAMES)
+    parser.add_argument("--ips", type=int, default=scheduler.IPS)
+    parser.add_argument("--output", default="farm.jsonl")
+    parser.add_argument("--workers", type=int, help="Default: one per core.")
+    parser.add_argument(
+        "--blocks",
+        action="store_true",
+        help="Execute with the basic-block translator.",
+    )
+    args = parser.parse_args()
+
+    roms = args.roms or bench.rom_paths()
+    start = time.perf_counter()
+    count = run(
+        roms,
+        args.variants,
+        args.frames,
+        args.output,
+        args.workers,
+        args.ips,
+        args.blocks,
+    )
+    print("{} jobs in {:.1f} s -> {}".format(
+        count, time.perf_counter() - start, args.output
+    ))
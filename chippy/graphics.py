@@ -1,5 +1,4 @@
 # Import modules
-import cv2 as cv
 import numpy as np
 
 # Screen constants
@@ -14,6 +13,21 @@ SCHIP_HEIGHT = 64
 
 
 class GFX(object):
+    """Headless CHIP8 / SCHIP display.
+
+    Keeps the framebuffer (and its history, used for flicker reduction) in
+    NumPy arrays. Rendering to a window is left to display adapters, cf.
+    chippy.sdl.SDLGFX.
+
+    The history is a ring buffer of the last DEPTH - 1 frames, most recent
+    at index head, alongside a running per-pixel count of ON pixels over the
+    VOTES - 1 most recent of them. Recording a frame therefore costs one
+    frame copy, whatever the DEPTH, and the vote needs no reduction.
+
+    Drawing, clearing and scrolling flag the frame as dirty so that
+    renderers can skip frames that have not changed.
+    """
+
     WIN_SIZE = (WIN_WIDTH, WIN_HEIGHT)
     MAX_HEIGHT = 16
     DEPTH = 11  # Screen depth (for smoothing)
@@ -28,9 +42,62 @@ class GFX(object):
         self.collision_flag = False
 
         # Chip8 screen
-        self.screen = np.zeros([self.height, self.width, GFX.DEPTH], np.uint8)
+        self.build_screen()
         self.weights = GFX.compute_screen_weights()
 
+    def build_screen(self):
+        self.frame = np.zeros([self.height, self.width], np.uint8)
+        self.history = np.zeros([GFX.DEPTH - 1, self.height, self.width], np.uint8)
+        self.votes = np.zeros([self.height, self.width], np.uint8)
+        self.head = 0
+        self.touch()
+
+    def touch(self):
+        """Flag the frame as modified (cf. dirty and quiet)."""
+        self.dirty = True  # Frame modified since last render
+        self.quiet = 0  # Frames recorded since last modification
+
+    @property
+    def screen(self):
+        """The frame and its history, stacked as a (height, width, DEPTH) array."""
+        order = (self.head + np.arange(GFX.DEPTH - 1)) % (GFX.DEPTH - 1)
+        return np.dstack([self.frame] + list(self.history[order]))
+
+    def record(self):
+        """Push the current frame onto the history."""
+        size = GFX.DEPTH - 1
+        window = GFX.VOTES - 1
+
+        if window:
+            self.votes -= self.history[(self.head + window - 1) % size]
+
+        self.head = (self.head - 1) % size
+        self.history[self.head] = self.frame
+        self.quiet += 1
+
+        if window:
+            self.votes += self.frame
+
+    def vote(self):
+        """Return the frame with pixels ON in any of the last VOTES frames."""
+        return self.frame | (self.votes > 0)
+
+    def settled(self):
+        """Whether the vote equals the frame (all voting frames are equal)."""
+        return self.quiet >= GFX.VOTES - 1
+
+    def load_frames(self, frame, history, head):
+        """Restore the frame and its history (e.g. from a save state)."""
+        self.frame[:] = frame
+        self.history[:] = history
+        self.head = head
+
+        # Rebuild the running vote count
+        size, window = GFX.DEPTH - 1, GFX.VOTES - 1
+        recent = (head + np.arange(window)) % size
+        self.votes[:] = self.history[recent].sum(axis=0)
+        self.touch()
+
     def draw_sprite(self, img, x, y):
         height = min(len(img), GFX.MAX_HEIGHT)
         bytes_per_row = (height // GFX.MAX_HEIGHT) + 1
@@ -43,38 +110,16 @@ class GFX(object):
         img_array = img.reshape([height, bytes_per_row])
         pxls = np.unpackbits(img_array, axis=1)[:dy, :dx]
 
-        self.collision_flag = (self.screen[y : y + dy, x : x + dx, 0] & pxls).any()
-        self.screen[y : y + dy, x : x + dx, 0] ^= pxls
+        self.collision_flag = (self.frame[y : y + dy, x : x + dx] & pxls).any()
+        self.frame[y : y + dy, x : x + dx] ^= pxls
+        self.touch()
 
         # Update draw buffer
-        self.screen[:, :, 1:] = self.screen[:, :, :-1]
+        self.record()
 
     def clear(self):
-        self.screen[:, :, 0] = np.zeros([self.height, self.width], np.uint8)
-
-    def draw(self):
-        # Build screen by combining smoothing strategies - exponential and vote
-        # smooth_screen = (self.screen * self.weights).sum(axis=2)
-        vote_screen = np.max(self.screen[:, :, : GFX.VOTES], axis=2)
-        # screen = (1 - vote_screen) * smooth_screen + vote_screen
-        screen = vote_screen
-
-        # Upscale chip8 screen to window size
-        screen = cv.resize(screen, GFX.WIN_SIZE, interpolation=cv.INTER_AREA)
-
-        # Map values to grayscale and filter sharp edges
-        screen = screen * (GFX.ON_COLOUR - GFX.OFF_COLOUR) + GFX.OFF_COLOUR
-        screen = cv.medianBlur(np.round(screen).astype(np.uint8), 3)
-
-        # Update draw buffer and return new screen
-        self.screen[:, :, 1:] = self.screen[:, :, :-1]
-        return screen
-
-    def sdl_screen(self):
-        """Convert a 2D pixel array and to (grayscale) uint32 array."""
-        screen = self.draw().astype(np.uint32)
-        sdl_screen = screen + np.left_shift(screen, 8)
-        return (screen + np.left_shift(sdl_screen, 8)).T
+        self.frame[:, :] = 0
+        self.touch()
 
     def set_resolution(self, resolution):
         if resolution == "low":
@@ -89,27 +134,199 @@ class GFX(object):
             raise ValueError("Unknown resolution. Use either high or low.")
 
         # Rebuild screen
-        self.screen = np.zeros([self.height, self.width, GFX.DEPTH], np.uint8)
+        self.build_screen()
 
     def scroll(self, direction, shift):
+        if direction not in ("down", "right", "left"):
+            raise ValueError("Unknown scroll direction")
+        if shift == 0:
+            return
+
         if direction == "down":
-            self.screen[shift:, :, 0] = self.screen[:-shift, :, 0]
-            self.screen[:shift, :, 0] = 0
+            self.frame[shift:, :] = self.frame[:-shift, :]
+            self.frame[:shift, :] = 0
 
         elif direction == "right":
-            self.screen[:, shift:, 0] = self.screen[:, :-shift, 0]
-            self.screen[:, :shift, 0] = 0
+            self.frame[:, shift:] = self.frame[:, :-shift]
+            self.frame[:, :shift] = 0
 
         elif direction == "left":
-            self.screen[:, :-shift, 0] = self.screen[:, shift:, 0]
-            self.screen[:, -shift:, 0] = 0
+            self.frame[:, :-shift] = self.frame[:, shift:]
+            self.frame[:, -shift:] = 0
 
         else:
             raise ValueError("Unknown scroll direction")
 
+        self.touch()
+
     @staticmethod
     def compute_screen_weights():
         weights = np.arange(0, GFX.DEPTH, dtype=float)
         weights = np.exp(-weights / GFX.DEPTH**2)
         weights /= weights.sum()
         return weights.reshape(1, 1, GFX.DEPTH)
+
+
+class PackedGFX(GFX):
+    """Display keeping each framebuffer row packed in a Python int.
+
+    Pixel x of a row is bit (width - 1 - x), so drawing a sprite row is a
+    shift, an AND (collision) and an XOR, and scrolling is row moves and
+    shifts: no arrays are built while emulating. The history holds tuples of
+    rows. Frames are only expanded to NumPy pixel arrays when asked for
+    (frame, history, screen, vote), e.g. by a renderer once per frame.
+
+    As in GFX, the vote is kept up to date as frames are recorded: the
+    per-pixel count of ON pixels over the VOTES - 1 most recent history
+    frames is held bit-sliced (planes of packed rows, a binary counter per
+    pixel), and only the rows that differ between the frame entering and
+    the frame leaving the vote window are updated.
+    """
+
+    PLANES = (GFX.VOTES - 1).bit_length()  # Bits of the per-pixel counts
+
+    def build_screen(self):
+        self.rows = [0] * self.height
+        self.mask = (1 << self.width) - 1
+        self.row_history = [tuple(self.rows)] * (GFX.DEPTH - 1)
+        self.head = 0
+        self.planes = [[0] * self.height for _ in range(PackedGFX.PLANES)]
+        self.voted = [0] * self.height  # Pixels ON in any voting frame
+        self.touch()
+
+    def expand(self, rows):
+        """Return rows as a (len(rows), width) array of 0 / 1 pixels."""
+        nbytes = self.width // 8
+        data = b"".join([row.to_bytes(nbytes, "big") for row in rows])
+        bits = np.unpackbits(np.frombuffer(data, np.uint8))
+        return bits.reshape(len(rows), self.width)
+
+    def pack(self, frame):
+        """Return the rows of a (height, width) pixel array, packed."""
+        data = np.packbits(np.asarray(frame, np.uint8), axis=1)
+        return [int.from_bytes(row.tobytes(), "big") for row in data]
+
+    @property
+    def frame(self):
+        return self.expand(self.rows)
+
+    @property
+    def history(self):
+        rows = [row for past in self.row_history for row in past]
+        return self.expand(rows).reshape(GFX.DEPTH - 1, self.height, self.width)
+
+    @property
+    def screen(self):
+        size = GFX.DEPTH - 1
+        order = [(self.head + i) % size for i in range(size)]
+        rows = list(self.rows)
+        for i in order:
+            rows.extend(self.row_history[i])
+
+        frames = self.expand(rows).reshape(GFX.DEPTH, self.height, self.width)
+        return np.dstack(frames)
+
+    def record(self):
+        size = GFX.DEPTH - 1
+        window = GFX.VOTES - 1
+        frame = tuple(self.rows)
+        left = self.row_history[(self.head + window - 1) % size]
+
+        self.head = (self.head - 1) % size
+        self.row_history[self.head] = frame
+        self.quiet += 1
+
+        if window and frame != left:
+            for r, (new, old) in enumerate(zip(frame, left)):
+                if new != old:
+                    self.count(r, new & ~old, old & ~new)
+
+    def count(self, r, added, removed):
+        """Count pixels added to / removed from the vote window in row r."""
+        planes = self.planes
+        for plane in planes:
+            if not (added or removed):
+                break
+            bits = plane[r]
+            plane[r] = bits ^ added ^ removed
+            # Carry into, or borrow from, the next bit of the counters
+            added, removed = bits & added, ~bits & removed
+
+        voted = 0
+        for plane in planes:
+            voted |= plane[r]
+        self.voted[r] = voted
+
+    def vote(self):
+        return self.expand(self.vote_rows())
+
+    def vote_rows(self):
+        """Return the vote screen (cf. vote) as packed rows."""
+        return [row | voted for row, voted in zip(self.rows, self.voted)]
+
+    def load_frames(self, frame, history, head):
+        self.rows = self.pack(frame)
+        self.row_history = [tuple(self.pack(past)) for past in history]
+        self.head = head
+
+        # Rebuild the vote counts
+        self.planes = [[0] * self.height for _ in range(PackedGFX.PLANES)]
+        self.voted = [0] * self.height
+        size = GFX.DEPTH - 1
+        for i in range(GFX.VOTES - 1):
+            for r, row in enumerate(self.row_history[(head + i) % size]):
+                self.count(r, row, 0)
+        self.touch()
+
+    def draw_sprite(self, img, x, y):
+        height = min(len(img), GFX.MAX_HEIGHT)
+        bytes_per_row = (height // GFX.MAX_HEIGHT) + 1
+        if x >= self.width or y >= self.height:
+            return
+
+        # Align the sprite's left edge with x (pixels past the edge drop off)
+        shift = self.width - 8 * bytes_per_row - x
+        data = img.tobytes()
+        rows = self.rows
+        collision = 0
+
+        for r in range(min(self.height - y, height)):
+            if bytes_per_row == 1:
+                sprite = data[r]
+            else:
+                sprite = (data[2 * r] << 8) | data[2 * r + 1]
+            sprite = sprite << shift if shift >= 0 else sprite >> -shift
+
+            collision |= rows[y + r] & sprite
+            rows[y + r] ^= sprite
+
+        self.collision_flag = collision != 0
+        self.touch()
+
+        # Update draw buffer
+        self.record()
+
+    def clear(self):
+        self.rows = [0] * self.height
+        self.touch()
+
+    def scroll(self, direction, shift):
+        if direction not in ("down", "right", "left"):
+            raise ValueError("Unknown scroll direction")
+        if shift == 0:  # rows[:-0] would be empty
+            return
+
+        rows = self.rows
+        if direction == "down":
+            self.rows = [0] * shift + rows[:-shift]
+
+        elif direction == "right":
+            self.rows = [row >> shift for row in rows]
+
+        elif direction == "left":
+            self.rows = [(row << shift) & self.mask for row in rows]
+
+        else:
+            raise ValueError("Unknown scroll direction")
+
+        self.touch()
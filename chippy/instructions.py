@@ -1,4 +1,4 @@
-import random
+from .graphics import SCHIP_WIDTH
 
 
 class Opcode(object):
@@ -12,26 +12,55 @@ class Opcode(object):
     NN : 8-bit constant,
     NNN: 12-bit address.
 
+    Opcodes are immutable and interned: constructing the same code twice
+    returns the same object, with its symbols extracted once.
+
     Parameters
     ----------
     code : int or str
         A two-byte (16-bit) opcode.
     """
 
+    __slots__ = ("code", "G", "X", "Y", "N", "NN", "NNN")
+
     _SYNUM = 4  # Total number of symbols in opcode
     _SYLENGTH = 4  # Length of opcode symbol in bits
+    _CACHE = [None] * 2**16  # Interned opcodes, built lazily
 
-    def __init__(self, code):
+    def __new__(cls, code):
         base = 16
 
         if isinstance(code, str):
             code = int(code, base)
 
-        assert (code < base**self._SYNUM) and (
+        assert (code < base**cls._SYNUM) and (
             code >= 0
         ), "OPCODE must range between '0000'--'FFFF'."
 
-        self.code = code
+        # Opcodes are immutable, so each code is only ever built once
+        opcode = cls._CACHE[code]
+        if opcode is None:
+            opcode = super(Opcode, cls).__new__(cls)
+            set_field = super(Opcode, cls).__setattr__
+            set_field(opcode, "code", code)
+            set_field(opcode, "G", opcode._extract_symbol(shift=3, length=1))
+            set_field(opcode, "X", opcode._extract_symbol(shift=2, length=1))
+            set_field(opcode, "Y", opcode._extract_symbol(shift=1, length=1))
+            set_field(opcode, "N", opcode._extract_symbol(shift=0, length=1))
+            set_field(opcode, "NN", opcode._extract_symbol(shift=0, length=2))
+            set_field(opcode, "NNN", opcode._extract_symbol(shift=0, length=3))
+            cls._CACHE[code] = opcode
+
+        return opcode
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Opcode objects are immutable.")
+
+    def __reduce__(self):
+        return (Opcode, (self.code,))
+
+    def __repr__(self):
+        return "Opcode('{}')".format(self.as_str())
 
     @classmethod
     def from_pair(cls, left_int, right_int):
@@ -60,44 +89,89 @@ class Opcode(object):
             ]
         )
 
-    @property
-    def G(self):
-        return self._extract_symbol(shift=3, length=1)
 
-    @property
-    def X(self):
-        return self._extract_symbol(shift=2, length=1)
+def idle_loop(machine, start, jump):
+    """Return the length of the idle loop start..jump, or 0 if not idle.
 
-    @property
-    def Y(self):
-        return self._extract_symbol(shift=1, length=1)
+    Called when the jump at address jump back to start has just executed.
+    Recognised loops wait for the delay timer ('FX07, 3XNN / 4XNN, 1NNN') or
+    poll a key ('EX9E / EXA1, 1NNN'), or jump to themselves. A loop is idle
+    if, with the machine state as it is, every iteration runs the same way:
+    nothing changes until the timers tick or a key event arrives.
+    """
+    memory, V, keyboard = machine.memory, machine.V, machine.keyboard
+    length = (jump - start) // 2 + 1
+
+    if (jump - start) % 2:  # Not instruction aligned
+        return 0
+    if length == 1:
+        return 1
+
+    G, X = memory[start] >> 4, memory[start] & 0xF
+    if length == 2 and memory[start + 1] == 0x9E and G == 0xE:
+        return 2 if keyboard.state[V[X]] != 1 else 0
+    if length == 2 and memory[start + 1] == 0xA1 and G == 0xE:
+        return 2 if keyboard.state[V[X]] != 0 else 0
+
+    if length == 3 and memory[start + 1] == 0x07 and G == 0xF:
+        G2, X2, NN = memory[start + 2] >> 4, memory[start + 2] & 0xF, memory[start + 3]
+        if X2 != X or V[X] != machine.delay_timer:
+            return 0
+        if G2 == 0x3:
+            return 3 if V[X] != NN else 0
+        if G2 == 0x4:
+            return 3 if V[X] == NN else 0
+    return 0
 
-    @property
-    def N(self):
-        return self._extract_symbol(shift=0, length=1)
 
-    @property
-    def NN(self):
-        return self._extract_symbol(shift=0, length=2)
+class InstructionSet(object):
+    """CHIP8 / SCHIP instruction handlers bound to a single opcode.
 
-    @property
-    def NNN(self):
-        return self._extract_symbol(shift=0, length=3)
+    Handlers are named after the opcode they implement, with 'M' acting as a
+    wildcard for operand symbols (e.g. '_8MM4' handles every '8XY4' opcode).
+    Operands are extracted once, on construction, so that repeated execution
+    of the same instruction does no decoding work.
 
+    Parameters
+    ----------
+    opcode : Opcode
+        The opcode to be executed.
+    """
 
-class InstructionSet(object):
     def __init__(self, opcode):
         self.opcode = opcode
 
+        # Pre-extract operands
+        self.X = opcode.X
+        self.Y = opcode.Y
+        self.N = opcode.N
+        self.NN = opcode.NN
+        self.NNN = opcode.NNN
+
+    @classmethod
+    def handler_names(cls):
+        """Return the set of instruction handler names."""
+        if "_handler_names" not in cls.__dict__:
+            names = [n for n in dir(cls) if n.startswith("_") and len(n) == 5]
+            cls._handler_names = set(names)
+        return cls._handler_names
+
+    @classmethod
+    def handler_name(cls, opcode):
+        """Return the name of the handler for opcode ('_NOP' if unknown)."""
+        ins_id = opcode.generate_masks().intersection(cls.handler_names())
+        return ins_id.pop() if ins_id else "_NOP"
+
+    def handler(self):
+        """Return the bound handler for this instruction."""
+        return getattr(self, self.handler_name(self.opcode))
+
     def execute(self, machine):
-        opcode_masks = self.opcode.generate_masks()
-        ins_id = opcode_masks.intersection(set(dir(self)))
-        fun = self.__getattribute__(ins_id.pop()) if ins_id else self._NOP
-        return fun(machine)
+        return self.handler()(machine)
 
     # ===== INSTRUCTIONS ==================================================== #
     def _00CM(self, machine):  # 00CN
-        machine.gfx.scroll("down", self.opcode.N)
+        machine.gfx.scroll("down", self.N)
 
     def _00FB(self, machine):  # 00FB
         machine.gfx.scroll("right", 4)
@@ -121,156 +195,306 @@ class InstructionSet(object):
         machine.pc = machine.stack.pop()
 
     def _1MMM(self, machine):  # 1NNN
-        machine.pc = self.opcode.NNN
+        jump = machine.pc - 2
+        if jump - self.NNN in (0, 2, 4):  # Short loop: flag it if idle
+            machine.idle = idle_loop(machine, self.NNN, jump)
+        machine.pc = self.NNN
 
     def _2MMM(self, machine):  # 2NNN
         machine.stack.append(machine.pc)
-        machine.pc = self.opcode.NNN
+        machine.pc = self.NNN
 
     def _3MMM(self, machine):  # 3XNN
-        if machine.V[self.opcode.X] == self.opcode.NN:
-            machine.pc += 2
+        if machine.V[self.X] == self.NN:
+            machine.pc = (machine.pc + 2) & 0xFFFF
 
     def _4MMM(self, machine):  # 4XNN
-        if machine.V[self.opcode.X] != self.opcode.NN:
-            machine.pc += 2
+        if machine.V[self.X] != self.NN:
+            machine.pc = (machine.pc + 2) & 0xFFFF
 
     def _5MMM(self, machine):  # 5XY0
-        if machine.V[self.opcode.X] == machine.V[self.opcode.Y]:
-            machine.pc += 2
+        if machine.V[self.X] == machine.V[self.Y]:
+            machine.pc = (machine.pc + 2) & 0xFFFF
 
     def _6MMM(self, machine):  # 6XNN
-        machine.V[self.opcode.X] = self.opcode.NN
+        machine.V[self.X] = self.NN
 
     def _7MMM(self, machine):  # 7XNN
-        machine.V[self.opcode.X] += self.opcode.NN
+        machine.V[self.X] = (machine.V[self.X] + self.NN) & 0xFF
 
     def _8MM0(self, machine):  # 8XY0
-        machine.V[self.opcode.X] = machine.V[self.opcode.Y]
+        machine.V[self.X] = machine.V[self.Y]
 
     def _8MM1(self, machine):  # 8XY1
-        machine.V[self.opcode.X] |= machine.V[self.opcode.Y]
+        machine.V[self.X] |= machine.V[self.Y]
         machine.V[0xF] = 0
 
     def _8MM2(self, machine):  # 8XY2
-        machine.V[self.opcode.X] &= machine.V[self.opcode.Y]
+        machine.V[self.X] &= machine.V[self.Y]
         machine.V[0xF] = 0
 
     def _8MM3(self, machine):  # 8XY3
-        machine.V[self.opcode.X] ^= machine.V[self.opcode.Y]
+        machine.V[self.X] ^= machine.V[self.Y]
         machine.V[0xF] = 0
 
+    # Note: VF is set before VX is updated (and VX / VY re-read), so that the
+    # flag is overwritten when X is 0xF.
     def _8MM4(self, machine):  # 8XY4
-        vf_check = machine.V[self.opcode.Y] > (0xFF - machine.V[self.opcode.X])
-        if vf_check:
-            machine.V[0xF] = 1
-            overflow = (0xFF - machine.V[self.opcode.Y]) + 1
-            machine.V[self.opcode.X] -= overflow
-        else:
-            machine.V[0xF] = 0
-            machine.V[self.opcode.X] += machine.V[self.opcode.Y]
+        vf_check = machine.V[self.Y] > (0xFF - machine.V[self.X])
+        machine.V[0xF] = 1 if vf_check else 0
+        machine.V[self.X] = (machine.V[self.X] + machine.V[self.Y]) & 0xFF
 
     def _8MM5(self, machine):  # 8XY5
-        vf_check = machine.V[self.opcode.X] < machine.V[self.opcode.Y]
-        if vf_check:
-            machine.V[0xF] = 0
-            overflow = (0xFF - machine.V[self.opcode.Y]) + 1
-            machine.V[self.opcode.X] += overflow
-        else:
-            machine.V[0xF] = 1
-            machine.V[self.opcode.X] -= machine.V[self.opcode.Y]
+        vf_check = machine.V[self.X] < machine.V[self.Y]
+        machine.V[0xF] = 0 if vf_check else 1
+        machine.V[self.X] = (machine.V[self.X] - machine.V[self.Y]) & 0xFF
 
     def _8MM6(self, machine):  # 8XY6
-        machine.V[0xF] = machine.V[self.opcode.X] & 0x1
-        machine.V[self.opcode.X] >>= 1
+        machine.V[0xF] = machine.V[self.X] & 0x1
+        machine.V[self.X] >>= 1
 
     def _8MM7(self, machine):  # 8XY7
-        vf_check = machine.V[self.opcode.Y] < machine.V[self.opcode.X]
-        if vf_check:
-            machine.V[0xF] = 0
-            overflow = (0xFF - machine.V[self.opcode.X]) + 1
-            machine.V[self.opcode.X] = machine.V[self.opcode.Y] + overflow
-        else:
-            machine.V[0xF] = 1
-            machine.V[self.opcode.X] = (
-                machine.V[self.opcode.Y] - machine.V[self.opcode.X]
-            )
+        vf_check = machine.V[self.Y] < machine.V[self.X]
+        machine.V[0xF] = 0 if vf_check else 1
+        machine.V[self.X] = (machine.V[self.Y] - machine.V[self.X]) & 0xFF
 
     def _8MME(self, machine):  # 8XYE
-        machine.V[0xF] = machine.V[self.opcode.X] >> 7
-        machine.V[self.opcode.X] <<= 1
+        machine.V[0xF] = machine.V[self.X] >> 7
+        machine.V[self.X] = (machine.V[self.X] << 1) & 0xFF
 
     def _9MMM(self, machine):  # 9XY0
-        if machine.V[self.opcode.X] != machine.V[self.opcode.Y]:
-            machine.pc += 2
+        if machine.V[self.X] != machine.V[self.Y]:
+            machine.pc = (machine.pc + 2) & 0xFFFF
 
     def _AMMM(self, machine):  # ANNN
-        machine.I = self.opcode.NNN
+        machine.I = self.NNN
 
     def _BMMM(self, machine):  # BNNN
-        machine.pc = machine.V[0x0] + self.opcode.NNN
+        machine.pc = machine.V[0x0] + self.NNN
 
     def _CMMM(self, machine):  # CXNN
-        machine.V[self.opcode.X] = random.randint(0, 255) & self.opcode.NN
+        machine.V[self.X] = machine.rng.randint(0, 255) & self.NN
 
     def _DMMM(self, machine):  # DXYN
-        N = self.opcode.N if self.opcode.N > 0 else 2 * machine.gfx.MAX_HEIGHT
-        img = machine.memory[machine.I : machine.I + N]
-        machine.gfx.draw_sprite(img, machine.V[self.opcode.X], machine.V[self.opcode.Y])
+        N = self.N if self.N > 0 else 2 * machine.gfx.MAX_HEIGHT
+        img = machine.memory_view[machine.I : machine.I + N]
+        machine.gfx.draw_sprite(img, machine.V[self.X], machine.V[self.Y])
         machine.V[0xF] = 1 if machine.gfx.collision_flag else 0
 
     def _EM9E(self, machine):  # EX9E
-        if machine.keyboard.state[machine.V[self.opcode.X]] == 1:
-            machine.pc += 2
+        if machine.keyboard.state[machine.V[self.X]] == 1:
+            machine.pc = (machine.pc + 2) & 0xFFFF
 
     def _EMA1(self, machine):  # EXA1
-        if machine.keyboard.state[machine.V[self.opcode.X]] == 0:
-            machine.pc += 2
+        if machine.keyboard.state[machine.V[self.X]] == 0:
+            machine.pc = (machine.pc + 2) & 0xFFFF
 
     def _FM07(self, machine):  # FX07
-        machine.V[self.opcode.X] = machine.delay_timer
+        machine.V[self.X] = machine.delay_timer
 
     def _FM0A(self, machine):  # FX0A
-        machine.V[self.opcode.X] = machine.keyboard.get_active_key()
+        key = machine.keyboard.get_active_key()
+        if machine.keyboard.state[key]:
+            machine.V[self.X] = key
+        else:  # Wait for a key press
+            machine.pc = (machine.pc - 2) & 0xFFFF
+            machine.idle = 1
 
     def _FM15(self, machine):  # FX15
-        machine.delay_timer = machine.V[self.opcode.X]
+        machine.delay_timer = machine.V[self.X]
 
     def _FM18(self, machine):  # FX18
-        machine.sound_timer = machine.V[self.opcode.X]
+        machine.sound_timer = machine.V[self.X]
 
     def _FM1E(self, machine):  # FX1E
-        vf_check = machine.I > (0xFFF - machine.V[self.opcode.X])
+        vf_check = machine.I > (0xFFF - machine.V[self.X])
         if vf_check:
             machine.V[0xF] = 1
-            overflow = (0xFFF - machine.V[self.opcode.X]) + 1
+            overflow = (0xFFF - machine.V[self.X]) + 1
             machine.I -= overflow
         else:
             machine.V[0xF] = 0
-            machine.I += machine.V[self.opcode.X]
+            machine.I += machine.V[self.X]
 
     def _FM29(self, machine):  # FX29
-        machine.I = machine.V[self.opcode.X] * 0x5
+        machine.I = machine.V[self.X] * 0x5
         # Note: sprites are stored as 4x5 hex font characters (0-F)
 
     def _FM30(self, machine):  # FX29
-        machine.I = machine.V[self.opcode.X] * 0xA + 16 * 0x5
+        machine.I = machine.V[self.X] * 0xA + 16 * 0x5
 
     def _FM33(self, machine):  # FX33
-        machine.memory[machine.I] = machine.V[self.opcode.X] // 100
-        machine.memory[machine.I + 1] = (machine.V[self.opcode.X] // 10) % 10
-        machine.memory[machine.I + 2] = (machine.V[self.opcode.X] % 100) % 10
+        machine.memory[machine.I] = machine.V[self.X] // 100
+        machine.memory[machine.I + 1] = (machine.V[self.X] // 10) % 10
+        machine.memory[machine.I + 2] = (machine.V[self.X] % 100) % 10
 
+    # Slice assignment resizes a bytearray when the lengths differ, so the
+    # register range is clipped at the end of memory.
     def _FM55(self, machine):  # FX55
-        reg_range = slice(0, self.opcode.X + 1)
-        mem_range = slice(machine.I, machine.I + self.opcode.X + 1)
-        machine.memory[mem_range] = machine.V[reg_range]
+        count = max(0, min(self.X + 1, len(machine.memory) - machine.I))
+        machine.memory[machine.I : machine.I + count] = machine.V[:count]
 
     def _FM65(self, machine):  # FX65
-        reg_range = slice(0, self.opcode.X + 1)
-        mem_range = slice(machine.I, machine.I + self.opcode.X + 1)
-        machine.V[reg_range] = machine.memory[mem_range]
+        count = max(0, min(self.X + 1, len(machine.memory) - machine.I))
+        machine.V[:count] = machine.memory[machine.I : machine.I + count]
+
+    def _FM75(self, machine):  # FX75
+        count = min(self.X, 7) + 1  # The HP48 has 8 user flags
+        machine.flags[:count] = machine.V[:count]
+
+    def _FM85(self, machine):  # FX85
+        count = min(self.X, 7) + 1
+        machine.V[:count] = machine.flags[:count]
 
     def _NOP(self, machine):  # Unknown Code
         print("Unknown code: {}".format(self.opcode.as_str()))
         print("Calling PC: {}".format(machine.pc - 2))
+
+
+class DecodeTable(dict):
+    """Opcode to bound instruction handler lookup table.
+
+    The table is indexed by the 16-bit opcode (as an int) and is filled on
+    first use of each opcode, so decoding an opcode that has been seen before
+    is a single lookup. Unknown opcodes map to the '_NOP' handler.
+
+    Parameters
+    ----------
+    instruction_set : type
+        InstructionSet (sub)class used to build the handlers.
+    """
+
+    def __init__(self, instruction_set=InstructionSet):
+        super(DecodeTable, self).__init__()
+        self.instruction_set = instruction_set
+
+    def __missing__(self, code):
+        handler = self.instruction_set(Opcode(code)).handler()
+        self[code] = handler
+        return handler
+
+
+class WrappedDecodeTable(DecodeTable):
+    """Decode table building wrapped handlers, e.g. for instrumentation.
+
+    Parameters
+    ----------
+    wrap : callable
+        Takes a bound handler and returns the function to call instead (or
+        the handler itself, to leave it unwrapped).
+    instruction_set : type
+        InstructionSet (sub)class used to build the handlers.
+    """
+
+    def __init__(self, wrap, instruction_set=InstructionSet):
+        super(WrappedDecodeTable, self).__init__(instruction_set)
+        self.wrap = wrap
+
+    def __missing__(self, code):
+        handler = self.instruction_set(Opcode(code)).handler()
+        wrapped = self.wrap(handler)
+
+        # Keep the bound handler interface (the translator inspects operands)
+        if wrapped is not handler:
+            wrapped.__self__ = handler.__self__
+        self[code] = wrapped
+        return wrapped
+
+
+class CosmacVIP(InstructionSet):
+    """Quirks of the original COSMAC VIP interpreter.
+
+    Shifts (8XY6 / 8XYE) shift VY into VX, and FX55 / FX65 leave I pointing
+    past the last register stored / loaded.
+    """
+
+    def _8MM6(self, machine):  # 8XY6
+        vy = machine.V[self.Y]
+        machine.V[0xF] = vy & 0x1
+        machine.V[self.X] = vy >> 1
+
+    def _8MME(self, machine):  # 8XYE
+        vy = machine.V[self.Y]
+        machine.V[0xF] = vy >> 7
+        machine.V[self.X] = (vy << 1) & 0xFF
+
+    def _FM55(self, machine):  # FX55
+        InstructionSet._FM55(self, machine)
+        machine.I = (machine.I + self.X + 1) & 0xFFFF
+
+    def _FM65(self, machine):  # FX65
+        InstructionSet._FM65(self, machine)
+        machine.I = (machine.I + self.X + 1) & 0xFFFF
+
+
+class Chip48(InstructionSet):
+    """Quirks of the HP48 CHIP-48 interpreter.
+
+    Logic operations (8XY1 - 8XY3) leave VF unchanged, BNNN jumps to XNN plus
+    VX (i.e. BXNN), and FX55 / FX65 advance I by X.
+    """
+
+    def _8MM1(self, machine):  # 8XY1
+        machine.V[self.X] |= machine.V[self.Y]
+
+    def _8MM2(self, machine):  # 8XY2
+        machine.V[self.X] &= machine.V[self.Y]
+
+    def _8MM3(self, machine):  # 8XY3
+        machine.V[self.X] ^= machine.V[self.Y]
+
+    def _BMMM(self, machine):  # BXNN
+        machine.pc = machine.V[self.X] + self.NNN
+
+    def _FM55(self, machine):  # FX55
+        InstructionSet._FM55(self, machine)
+        machine.I = (machine.I + self.X) & 0xFFFF
+
+    def _FM65(self, machine):  # FX65
+        InstructionSet._FM65(self, machine)
+        machine.I = (machine.I + self.X) & 0xFFFF
+
+
+class SuperChip11(Chip48):
+    """Quirks of the HP48 SCHIP 1.1 interpreter.
+
+    As CHIP-48, but FX55 / FX65 leave I unchanged, and scrolling is measured
+    in high resolution pixels: in low resolution, screens scroll by half as
+    many (low resolution) pixels.
+    """
+
+    _FM55 = InstructionSet._FM55
+    _FM65 = InstructionSet._FM65
+
+    def _00CM(self, machine):  # 00CN
+        shift = self.N if machine.gfx.width == SCHIP_WIDTH else self.N // 2
+        if shift:
+            machine.gfx.scroll("down", shift)
+
+    def _00FB(self, machine):  # 00FB
+        machine.gfx.scroll("right", 4 if machine.gfx.width == SCHIP_WIDTH else 2)
+
+    def _00FC(self, machine):  # 00FC
+        machine.gfx.scroll("left", 4 if machine.gfx.width == SCHIP_WIDTH else 2)
+
+
+# Quirk profiles, by name (default: InstructionSet)
+QUIRKS = {"vip": CosmacVIP, "chip48": Chip48, "schip": SuperChip11}
+
+DECODE_TABLE = DecodeTable()
+_DECODE_TABLES = {None: DECODE_TABLE}
+
+
+def decode_table(quirks=None):
+    """Return the decode table (shared between machines) of a quirk profile.
+
+    Parameters
+    ----------
+    quirks : str, optional
+        Name of the profile, cf. QUIRKS (default: InstructionSet).
+    """
+    if quirks not in _DECODE_TABLES:
+        if quirks not in QUIRKS:
+            raise ValueError("Unknown quirk profile: {}".format(quirks))
+        _DECODE_TABLES[quirks] = DecodeTable(QUIRKS[quirks])
+    return _DECODE_TABLES[quirks]
@@ -1,65 +1,52 @@
 import numpy as np
-import pygame
 
 
 class HexKeyboard(object):
-    key_map = {
-        pygame.K_1: 0x1,
-        pygame.K_2: 0x2,
-        pygame.K_3: 0x3,
-        pygame.K_4: 0xC,
-        pygame.K_q: 0x4,
-        pygame.K_w: 0x5,
-        pygame.K_e: 0x6,
-        pygame.K_r: 0xD,
-        pygame.K_a: 0x7,
-        pygame.K_s: 0x8,
-        pygame.K_d: 0x9,
-        pygame.K_f: 0xE,
-        pygame.K_z: 0xA,
-        pygame.K_x: 0x0,
-        pygame.K_c: 0xB,
-        pygame.K_v: 0xF,
-        pygame.K_p: 16,        # Extra Feature: Pause Emulator
-        pygame.K_TAB: 17,      # Extra Feature: Reset Emulator
-        pygame.K_ESCAPE: 18,   # Extra Feature: Turn Off Emulator
-    }
+    """Headless CHIP8 hexadecimal keypad.
+
+    Key state is kept in a boolean array indexed by key id: the 16 hex keys
+    (0x0-0xF) followed by the emulator's extra PAUSE, RESET and EXIT keys.
+    Input adapters (cf. chippy.sdl.SDLKeyboard) translate their own events
+    into press / release calls.
+    """
+
+    HEX_KEYS = 16          # Number of hex keys
+    PAUSE = 16             # Extra Feature: Pause Emulator
+    RESET = 17             # Extra Feature: Reset Emulator
+    EXIT = 18              # Extra Feature: Turn Off Emulator
+    KEYS = 19              # Total number of keys
 
     def __init__(self):
-        self.state = np.zeros(len(self.key_map), dtype=bool)
+        self.state = np.zeros(HexKeyboard.KEYS, dtype=bool)
 
-    def update_key_press(self, event):
-        if event.type == pygame.KEYDOWN and event.key is pygame.K_p:
+    def press(self, key):
+        if key == HexKeyboard.PAUSE:
             self.set_pause()
+        else:
+            self.state[key] = True
 
-        elif event.type == pygame.KEYDOWN and event.key in self.key_map:
-            self.state[self.key_map[event.key]] = True
-
-    def update_key_release(self, event):
-        if event.type == pygame.KEYUP and event.key is pygame.K_p:
+    def release(self, key):
+        if key == HexKeyboard.PAUSE:
             return
-
-        elif event.type == pygame.KEYUP and event.key in self.key_map:
-            self.state[self.key_map[event.key]] = False
+        self.state[key] = False
 
     def get_active_key(self):
-        return self.state[:16].argmax()  # Only care about the hex keys.
+        return self.state[: HexKeyboard.HEX_KEYS].argmax()  # Only hex keys.
 
     def reset(self):
-        self.state = np.zeros(len(self.key_map), dtype=bool)
+        self.state = np.zeros(HexKeyboard.KEYS, dtype=bool)
 
     def set_exit(self):
-        self.state[self.key_map[pygame.K_ESCAPE]] = True
+        self.state[HexKeyboard.EXIT] = True
 
     def set_pause(self):
-        pause_idx = self.key_map[pygame.K_p]
-        self.state[pause_idx] = ~self.state[pause_idx]
+        self.state[HexKeyboard.PAUSE] = ~self.state[HexKeyboard.PAUSE]
 
     def is_exit(self):
-        return self.state[self.key_map[pygame.K_ESCAPE]]
+        return self.state[HexKeyboard.EXIT]
 
     def is_reset(self):
-        return self.state[self.key_map[pygame.K_TAB]]
+        return self.state[HexKeyboard.RESET]
 
     def is_paused(self):
-        return self.state[self.key_map[pygame.K_p]]
+        return self.state[HexKeyboard.PAUSE]
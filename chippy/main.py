@@ -1,53 +1,168 @@
-import pygame
+import random
 
-from . import core
+import pygame
 
-SECOND = 1000         # Milliseconds in second
-FPS = 60              # Frames per second
-OPPF = 18             # Opcodes executed per frame
+from . import core, instructions, movie, scheduler, sdl, threads, translate
 
 
-def main(game_path):
+def main(
+    game_path,
+    smooth=True,
+    ips=scheduler.IPS,
+    turbo=False,
+    blocks=False,
+    threaded=False,
+    record=None,
+    seed=None,
+    quirks=None,
+):
     # Initialization
-    machine = core.Machine()
-    machine.load_game(game_path)
+    seed = seed if seed is not None else random.getrandbits(32)
+    machine = core.Machine(sdl.SDLBackend(smooth), seed)
+    machine.load_game(game_path, quirks)
+    recorder = (
+        movie.MovieWriter(record, seed, ips, machine.quirks) if record else None
+    )
+    engine = translate.BlockTranslator(machine) if blocks else None
+    clock = scheduler.Scheduler(machine, ips=ips, turbo=turbo, engine=engine)
 
     pygame.init()
-    caption = "CHIPPY | Currently playing: {}"
-    pygame.display.set_caption(caption.format(machine.game))
+    caption = "CHIPPY | Currently playing: {} | {:.0f} IPS, {:.0f} FPS"
+    pygame.display.set_caption(caption.format(machine.game, 0, 0))
     screen = pygame.display.set_mode(machine.gfx.WIN_SIZE)
 
+    if threaded:
+        run_threaded(machine, clock, screen, caption, recorder)
+        if recorder is not None:
+            recorder.close(clock.frames)
+        pygame.quit()
+        return
+
     # Start gameloop
     running = True
     while running:
-        # Emulate chip8 cpu cycle
+        # Emulate chip8 cpu cycles due this frame
         if machine.keyboard.is_exit():
             break
 
-        for _ in range(OPPF):
-            pygame.time.wait(int(SECOND / FPS / OPPF))  # Slow down execution
-            machine.emulate_cycle()
-        machine.decrement_timers()  # unindent for reasonable reaction time
+        clock.tick()
 
         # Poll events
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
 
-            machine.keyboard.update_key_press(event)
-            machine.keyboard.update_key_release(event)
+            key_event = machine.keyboard.key_event(event)
+            if key_event is not None:
+                key, pressed = key_event
+                if recorder is not None:
+                    recorder.record(clock.frames, key, pressed)
+                if pressed:
+                    machine.keyboard.press(key)
+                else:
+                    machine.keyboard.release(key)
 
         # Update graphics (sdl)
-        pixel_data = machine.gfx.sdl_screen()
-        pygame.surfarray.blit_array(screen, pixel_data)
+        machine.gfx.blit(screen)
         pygame.display.flip()
 
+        if clock.ticks % scheduler.FPS == 0:  # Report achieved speed
+            stats = caption.format(machine.game, clock.ips, clock.fps)
+            pygame.display.set_caption(stats)
+
+        clock.wait()
+
     # Kill everything!
+    if recorder is not None:
+        recorder.close(clock.frames)
     pygame.quit()
 
 
+def run_threaded(machine, clock, screen, caption, recorder=None):
+    """Game loop with emulation on a worker thread and rendering on this one."""
+    emulator = threads.EmulationThread(machine, clock, recorder)
+    emulator.start()
+    render_clock = pygame.time.Clock()
+    sequence = 0
+
+    while emulator.is_alive():
+        # Poll events (applied to the keyboard by the emulation thread)
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                emulator.stop()
+
+            key_event = machine.keyboard.key_event(event)
+            if key_event is not None:
+                emulator.send_key(*key_event)
+
+        # Update graphics (sdl) with the latest emulated frame
+        frame = emulator.frames.take(sequence)
+        if frame is not None:
+            sequence, vote_screen = frame
+            machine.gfx.present(screen, vote_screen)
+            pygame.display.flip()
+
+        render_clock.tick(scheduler.FPS)
+        if sequence % scheduler.FPS == 0:  # Report achieved speed
+            stats = caption.format(machine.game, clock.ips, render_clock.get_fps())
+            pygame.display.set_caption(stats)
+
+    emulator.join()
+
+
 # Launch from command line
 if __name__ == "__main__":
-    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="CHIP8 / SCHIP emulator.")
+    parser.add_argument("game_path", help="Path to ROM, e.g. games/chip8/BRIX")
+    parser.add_argument(
+        "--sharp",
+        action="store_true",
+        help="Plain integer upscaling, without OpenCV smoothing.",
+    )
+    parser.add_argument(
+        "--ips",
+        type=int,
+        default=scheduler.IPS,
+        help="Instructions per second (default: {}).".format(scheduler.IPS),
+    )
+    parser.add_argument(
+        "--turbo", action="store_true", help="Run as fast as possible."
+    )
+    parser.add_argument(
+        "--blocks",
+        action="store_true",
+        help="Execute with the basic-block translator.",
+    )
+    parser.add_argument(
+        "--threaded",
+        action="store_true",
+        help="Emulate on a separate thread from rendering.",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="MOVIE",
+        help="Record key input to a movie file (see chippy.movie).",
+    )
+    parser.add_argument(
+        "--seed", type=int, help="Random number generator seed."
+    )
+    parser.add_argument(
+        "--quirks",
+        choices=sorted(instructions.QUIRKS),
+        help="Quirk profile (default: the catalog's, for bundled ROMs).",
+    )
+    args = parser.parse_args()
 
-    main(sys.argv[1])
+    main(
+        args.game_path,
+        not args.sharp,
+        args.ips,
+        args.turbo,
+        args.blocks,
+        args.threaded,
+        args.record,
+        args.seed,
+        args.quirks,
+    )
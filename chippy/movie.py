@@ -0,0 +1,193 @@
+"""Input movies: recorded key events, for reproducible (headless) replays.
+
+A movie is the machine's RNG seed and quirk profile followed by the key
+events of a session, each stamped with the number of frames emulated before
+it was applied. Given the same ROM and instruction rate, replaying a movie
+reproduces the session exactly, and since frames are not paced, as fast as
+the interpreter runs:
+
+    python -m chippy.movie games/chip8/BRIX session.movie
+
+Movies are binary: a short header, then 5 bytes per event (frame, key and
+a pressed bit), written and read as a stream, closed by an end marker event
+holding the number of frames the session lasted.
+"""
+import struct
+
+from . import core, scheduler, state
+
+MAGIC = b"CHPM"
+VERSION = 3
+PRESSED = 0x80  # Key byte flag for a key press (otherwise a release)
+END = 0x7F  # Key byte of the end marker (frame: frames emulated in all)
+
+# magic, version, instructions per second, seed, quirk profile (b"": none)
+_HEADER = struct.Struct("<4sBIQ8s")
+# frame, key | PRESSED
+_EVENT = struct.Struct("<IB")
+
+
+class MovieWriter(object):
+    """Stream key events to a movie file.
+
+    Parameters
+    ----------
+    path : str
+        File written.
+    seed : int
+        Seed of the recorded machine's RNG.
+    ips : int
+        Instructions per second the session runs at.
+    quirks : str, optional
+        Quirk profile of the recorded machine (cf. instructions.QUIRKS).
+    """
+
+    def __init__(self, path, seed, ips=scheduler.IPS, quirks=None):
+        self.file = open(path, "wb")
+        profile = (quirks or "").encode("ascii")
+        self.file.write(_HEADER.pack(MAGIC, VERSION, ips, seed, profile))
+
+    def record(self, frame, key, pressed):
+        """Record a key event applied after frame frames were emulated."""
+        self.file.write(_EVENT.pack(frame, key | (PRESSED if pressed else 0)))
+
+    def close(self, frames=None):
+        """Close the movie, marking its end after frames frames (if given)."""
+        if frames is not None:
+            self.file.write(_EVENT.pack(frames, END))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MovieReader(object):
+    """Stream (frame, key, pressed) events from a movie file.
+
+    Parameters
+    ----------
+    path : str
+        File read.
+
+    Attributes
+    ----------
+    frames : int or None
+        Frames the session lasted, once the end marker is read (None until
+        then, or for movies without one).
+    """
+
+    CHUNK = 4096  # Events read at a time
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        header = self.file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError("Not a chippy movie.")
+
+        magic, version, self.ips, self.seed, profile = _HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError("Not a chippy movie.")
+        if version not in (2, VERSION):  # Version 2: no end marker
+            raise ValueError("Unsupported movie version: {}".format(version))
+        self.quirks = profile.rstrip(b"\0").decode("ascii") or None
+        self.frames = None
+
+    def __iter__(self):
+        while True:
+            chunk = self.file.read(MovieReader.CHUNK * _EVENT.size)
+            usable = len(chunk) - len(chunk) % _EVENT.size
+            for frame, key in _EVENT.iter_unpack(chunk[:usable]):
+                if key == END:
+                    self.frames = frame
+                    return
+                yield frame, key & ~PRESSED, bool(key & PRESSED)
+            if len(chunk) < MovieReader.CHUNK * _EVENT.size:
+                return
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def replay(machine, path, engine=None, frames=0):
+    """Replay a movie on machine (with its game loaded), unthrottled.
+
+    The machine must run the movie's quirk profile. It is reseeded from the
+    movie, its events are applied at the recorded frames, emulation runs on
+    to the recorded end of the session and frames extra frames are emulated
+    after it. Return the scheduler used, for its statistics.
+    """
+    with MovieReader(path) as movie:
+        if machine.quirks != movie.quirks:
+            raise ValueError(
+                "Movie recorded with quirk profile {}, not {}.".format(
+                    movie.quirks, machine.quirks
+                )
+            )
+        machine.seed(movie.seed)
+        clock = scheduler.Scheduler(machine, movie.ips, turbo=True, engine=engine)
+        keyboard = machine.keyboard
+
+        for frame, key, pressed in movie:
+            while clock.frames < frame:
+                clock.emulate_frame()
+            if pressed:
+                keyboard.press(key)
+            else:
+                keyboard.release(key)
+
+        while movie.frames is not None and clock.frames < movie.frames:
+            clock.emulate_frame()
+
+    for _ in range(frames):
+        clock.emulate_frame()
+    return clock
+
+
+# Replay from command line
+if __name__ == "__main__":
+    import argparse
+    import hashlib
+    import time
+
+    from . import translate
+
+    parser = argparse.ArgumentParser(description="Replay a chippy movie.")
+    parser.add_argument("game_path", help="Path to ROM, e.g. games/chip8/BRIX")
+    parser.add_argument("movie", help="Movie recorded with chippy.main --record")
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=0,
+        help="Frames to emulate after the end of the movie.",
+    )
+    parser.add_argument(
+        "--blocks",
+        action="store_true",
+        help="Execute with the basic-block translator.",
+    )
+    args = parser.parse_args()
+
+    with MovieReader(args.movie) as header:
+        quirks = header.quirks
+
+    machine = core.Machine()
+    machine.load_game(args.game_path, quirks)
+    engine = translate.BlockTranslator(machine) if args.blocks else None
+
+    start = time.perf_counter()
+    clock = replay(machine, args.movie, engine, args.frames)
+    elapsed = time.perf_counter() - start
+
+    print("{} frames, {} instructions in {:.2f} s ({:.0f} IPS)".format(
+        clock.frames, clock.instructions, elapsed, clock.instructions / elapsed
+    ))
+    print("final state: {}".format(hashlib.md5(state.dumps(machine)).hexdigest()))
@@ -0,0 +1,147 @@
+"""Per-opcode and per-PC execution profiling.
+
+Profiling is opt-in and costs nothing when off: a Profiler attached to a
+machine swaps the machine's decode table for one whose handlers are wrapped
+with counters, and detaching restores the shared table. Counters live in
+preallocated arrays indexed by handler (execution count and cumulative time)
+and by address (a 4096-entry PC hit histogram), and sprite draws / collisions
+are counted too.
+
+Only instructions dispatched through machine.decode_table are seen, i.e.
+stepwise execution (Machine.emulate_cycle), not translated blocks. Idle loop
+fast-forward (cf. Machine.run) is disabled while attached, so busy-wait loops
+are counted at every iteration.
+"""
+import array
+import functools
+import json
+import time
+
+from .instructions import InstructionSet, WrappedDecodeTable, decode_table
+
+
+class Profiler(object):
+    """Collect instruction counts and times, PC hits and draw statistics.
+
+    Parameters
+    ----------
+    instruction_set : type
+        InstructionSet (sub)class profiled until attached; its handler names
+        index the per-handler counters. Attached machines are profiled with
+        their own instruction set (quirk profile).
+    """
+
+    ADDRESSES = 4096  # Size of the PC histogram
+
+    def __init__(self, instruction_set=InstructionSet):
+        self.instruction_set = instruction_set
+        self.names = ["_NOP"] + sorted(instruction_set.handler_names())
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.counts = array.array("Q", [0] * len(self.names))
+        self.times = array.array("d", [0.0] * len(self.names))
+        self.pc_hits = array.array("Q", [0] * Profiler.ADDRESSES)
+        self.draws = array.array("Q", [0, 0])  # Sprites drawn, collisions
+        self.decode_table = WrappedDecodeTable(self.wrap, instruction_set)
+
+    def attach(self, machine):
+        """Profile the instructions machine executes from now on."""
+        instruction_set = machine.decode_table.instruction_set
+        if instruction_set is not self.decode_table.instruction_set:
+            self.decode_table = WrappedDecodeTable(self.wrap, instruction_set)
+        machine.decode_table = self.decode_table
+
+    def detach(self, machine):
+        """Stop profiling machine (restore its shared decode table)."""
+        machine.decode_table = decode_table(machine.quirks)
+
+    def reset(self):
+        """Zero all counters."""
+        for counters in (self.counts, self.times, self.pc_hits, self.draws):
+            for i in range(len(counters)):
+                counters[i] = 0
+
+    def wrap(self, handler):
+        """Return handler wrapped to update the counters."""
+        index = self.index[handler.__name__]
+        counts, times, pc_hits, draws = (
+            self.counts,
+            self.times,
+            self.pc_hits,
+            self.draws,
+        )
+        clock = time.perf_counter
+        mask = Profiler.ADDRESSES - 1
+
+        if handler.__name__ == "_DMMM":
+
+            @functools.wraps(handler)
+            def profiled(machine):
+                pc_hits[(machine.pc - 2) & mask] += 1
+                start = clock()
+                handler(machine)
+                times[index] += clock() - start
+                counts[index] += 1
+                draws[0] += 1
+                draws[1] += machine.V[0xF] & 1
+
+        else:
+
+            @functools.wraps(handler)
+            def profiled(machine):
+                pc_hits[(machine.pc - 2) & mask] += 1
+                start = clock()
+                handler(machine)
+                times[index] += clock() - start
+                counts[index] += 1
+                machine.idle = 0  # Dispatch every idle loop iteration
+
+        return profiled
+
+    def hot_addresses(self, top=10):
+        """Return the top most executed (address, hits), most first."""
+        hits = [(n, pc) for pc, n in enumerate(self.pc_hits) if n]
+        return [(pc, n) for n, pc in sorted(hits, reverse=True)[:top]]
+
+    def to_dict(self):
+        """Return the counters as plain (JSON serialisable) data."""
+        handlers = {}
+        for name, count, seconds in zip(self.names, self.counts, self.times):
+            if count:
+                handlers[name[1:]] = {"count": count, "seconds": seconds}
+        return {
+            "instructions": sum(self.counts),
+            "handlers": handlers,
+            "pc_hits": list(self.pc_hits),
+            "draws": self.draws[0],
+            "collisions": self.draws[1],
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def report(self, top=10):
+        """Return a flat text report of the counters."""
+        total = sum(self.counts)
+        lines = ["{:<8} {:>12} {:>7} {:>10}".format("opcode", "count", "%", "ns/call")]
+        order = sorted(range(len(self.names)), key=lambda i: -self.counts[i])
+        for i in order:
+            count = self.counts[i]
+            if not count:
+                break
+            lines.append(
+                "{:<8} {:>12} {:>7.1%} {:>10.0f}".format(
+                    self.names[i][1:],
+                    count,
+                    count / float(total),
+                    1e9 * self.times[i] / count,
+                )
+            )
+
+        lines.append("")
+        lines.append("{:<8} {:>12}".format("address", "hits"))
+        for pc, hits in self.hot_addresses(top):
+            lines.append("{:<8} {:>12}".format("{:#05x}".format(pc), hits))
+
+        lines.append("")
+        lines.append("sprites drawn: {}, collisions: {}".format(*self.draws))
+        return "\n".join(lines)
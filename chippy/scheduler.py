@@ -0,0 +1,107 @@
+"""Frame paced execution of a machine."""
+import time
+
+FPS = 60  # Timer (and frame) rate, Hz
+IPS = 18 * FPS  # Default instructions per second
+
+
+class Scheduler(object):
+    """Runs a machine at a fixed instruction rate, one batch per frame.
+
+    Each emulated frame runs the frame's share of the instruction budget
+    (fractions are carried over) and then ticks the timers once. In normal
+    mode frames are emulated as wall-clock time accrues: a slow host catches
+    up by emulating several frames per tick, up to max_lag seconds, beyond
+    which the lag is dropped. In turbo mode every tick emulates one frame
+    and wait() does not sleep, so the machine runs as fast as it can.
+
+    Parameters
+    ----------
+    machine : core.Machine
+        The machine to run.
+    ips : int
+        Instructions per second.
+    fps : int
+        Timer rate (frames per second).
+    turbo : bool
+        Run unthrottled.
+    max_lag : float
+        Longest time (in seconds) to catch up on after falling behind.
+    engine : object, optional
+        Object executing instructions with run(cycles), which returns the
+        number executed, e.g. a translate.BlockTranslator (default: the
+        machine itself).
+    """
+
+    STATS_PERIOD = 1.0  # Seconds between updates of the achieved rates
+
+    def __init__(
+        self, machine, ips=IPS, fps=FPS, turbo=False, max_lag=0.25, engine=None
+    ):
+        self.machine = machine
+        self.engine = engine if engine is not None else machine
+        self.target_ips = ips
+        self.target_fps = fps
+        self.turbo = turbo
+        self.max_lag = max_lag
+
+        self.frame_time = 1.0 / fps
+        self.budget = 0.0  # Instructions owed (fractional part)
+        self.lag = 0.0  # Wall-clock time not yet emulated
+        self.last = time.perf_counter()
+
+        # Statistics
+        self.instructions = 0  # Instructions executed
+        self.frames = 0  # Frames emulated
+        self.ticks = 0  # Calls to tick (i.e. frames presented)
+        self.ips = 0.0  # Achieved instructions per second
+        self.fps = 0.0  # Achieved ticks per second
+        self._stats = (self.last, 0, 0)
+
+    def emulate_frame(self):
+        self.budget += float(self.target_ips) / self.target_fps
+        cycles = int(self.budget)
+        self.budget -= cycles
+
+        self.instructions += self.engine.run(cycles)  # Idle loops skipped
+        self.machine.decrement_timers()
+
+        self.frames += 1
+
+    def tick(self):
+        """Emulate the frames due since the last tick; return their number."""
+        now = time.perf_counter()
+
+        if self.turbo:
+            frames = 1
+        else:
+            self.lag = min(self.lag + now - self.last, self.max_lag)
+            frames = int(self.lag / self.frame_time)
+            self.lag -= frames * self.frame_time
+        self.last = now
+
+        for _ in range(frames):
+            self.emulate_frame()
+
+        self.ticks += 1
+        self.update_stats(now)
+        return frames
+
+    def wait(self):
+        """Sleep until the next frame is due (no-op in turbo mode)."""
+        if self.turbo:
+            return
+
+        delay = self.frame_time - self.lag - (time.perf_counter() - self.last)
+        if delay > 0:
+            time.sleep(delay)
+
+    def update_stats(self, now):
+        then, instructions, ticks = self._stats
+        elapsed = now - then
+        if elapsed < Scheduler.STATS_PERIOD:
+            return
+
+        self.ips = (self.instructions - instructions) / elapsed
+        self.fps = (self.ticks - ticks) / elapsed
+        self._stats = (now, self.instructions, self.ticks)
@@ -0,0 +1,242 @@
+"""Pygame (SDL) display / input adapters.
+
+OpenCV is only imported by the smoothing renderer (SDLGFX), when it renders.
+"""
+import collections
+import math
+
+import numpy as np
+import pygame
+
+from .backends import HeadlessBackend
+from .graphics import GFX, WIN_HEIGHT, WIN_WIDTH, PackedGFX
+from .keyboard import HexKeyboard
+
+
+class SDLGFX(PackedGFX):
+    """Display rendering the framebuffer to an upscaled, smoothed SDL array.
+
+    Output buffers are reused between frames: nothing is rendered when the
+    vote screen is unchanged, only the window rows covering changed screen
+    rows are re-rendered otherwise, and recently rendered frames are kept in
+    a small LRU cache (keyed by the packed 1-bit vote screen).
+    """
+
+    CACHE_SIZE = 8  # Number of rendered frames kept for reuse
+
+    def __init__(self):
+        super(SDLGFX, self).__init__()
+        self.gray = np.zeros([WIN_HEIGHT, WIN_WIDTH], np.uint8)
+        self.pixels = np.zeros([WIN_WIDTH, WIN_HEIGHT], np.uint32)
+        self.rendered = None  # Vote screen currently in the output buffers
+        self.rendered_settled = False
+        self.cache = collections.OrderedDict()
+
+    def render(self, screen, rows=None):
+        """Render screen rows (default: all) into the output buffers."""
+        import cv2 as cv
+
+        height = screen.shape[0]
+        if rows is None:
+            top, bottom = 0, WIN_HEIGHT
+        else:
+            # Window rows influenced by the screen rows (interpolation)
+            scale = WIN_HEIGHT / float(height)
+            top = max(0, int((rows[0] - 1) * scale))
+            bottom = min(WIN_HEIGHT, int(np.ceil((rows[-1] + 2) * scale)))
+
+        # Window rows needed (a row of context either side of the band for
+        # the filter), widened to whole spans: period screen rows upscale to
+        # exactly span window rows, so resizing only the screen rows of whole
+        # spans gives the same pixels as resizing the whole screen.
+        lo, hi = max(0, top - 1), min(WIN_HEIGHT, bottom + 1)
+        period = height // math.gcd(height, WIN_HEIGHT)
+        span = WIN_HEIGHT * period // height
+        start, stop = lo // span * span, -(-hi // span) * span
+
+        # Upscale the band of the chip8 screen to window size
+        band = screen[start * height // WIN_HEIGHT : stop * height // WIN_HEIGHT]
+        band = cv.resize(band, (WIN_WIDTH, stop - start), interpolation=cv.INTER_AREA)
+
+        # Map values to grayscale and filter sharp edges
+        band = band[lo - start : hi - start]
+        band = band * (GFX.ON_COLOUR - GFX.OFF_COLOUR) + GFX.OFF_COLOUR
+        band = cv.medianBlur(np.round(band).astype(np.uint8), 3)
+
+        self.gray[top:bottom] = band[top - lo : bottom - lo]
+        self.pixels[:, top:bottom] = self.gray[top:bottom].T * 0x010101
+
+    def update(self, screen):
+        """Bring the output buffers up to date with screen."""
+        rows = None
+        if self.rendered is not None and self.rendered.shape == screen.shape:
+            rows = np.flatnonzero((screen != self.rendered).any(axis=1))
+            if not rows.size:
+                return
+        self.rendered = screen
+
+        key = (screen.shape, np.packbits(screen).tobytes())
+        if key in self.cache:
+            self.cache[key] = self.cache.pop(key)  # Most recently used
+            self.gray[:] = self.cache[key]
+            self.pixels[:] = self.gray.T * 0x010101
+            return
+
+        self.render(screen, rows)
+        self.cache[key] = self.gray.copy()
+        if len(self.cache) > SDLGFX.CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+    def draw(self):
+        # Build screen by combining smoothing strategies - exponential and vote
+        # smooth_screen = (self.screen * self.weights).sum(axis=2)
+        # screen = (1 - vote_screen) * smooth_screen + vote_screen
+        if self.dirty or not self.rendered_settled:
+            self.update(self.vote())
+            self.rendered_settled = self.settled()
+            self.dirty = False
+
+        # Update draw buffer and return new screen
+        self.record()
+        return self.gray
+
+    def sdl_screen(self):
+        """Return the screen as a (grayscale) uint32 array, for pygame."""
+        self.draw()
+        return self.pixels
+
+    def blit(self, surface):
+        pygame.surfarray.blit_array(surface, self.sdl_screen())
+
+    def present(self, surface, screen):
+        """Render a vote screen produced elsewhere (e.g. another thread)."""
+        self.update(screen)
+        pygame.surfarray.blit_array(surface, self.pixels)
+
+
+class SurfaceGFX(PackedGFX):
+    """Display upscaling the screen straight into a pygame surface.
+
+    The vote screen is mapped through a two colour palette and upscaled by
+    the largest integer factor that fits the window, centred, by writing a
+    broadcast (strided) view of the surface's pixel array in place. No
+    window-sized temporaries are built and OpenCV is not needed; there is no
+    smoothing filter.
+    """
+
+    def __init__(self):
+        super(SurfaceGFX, self).__init__()
+        self.rendered = None  # Vote screen currently on the surface
+        self.rendered_settled = False
+
+    def blit(self, surface):
+        if self.dirty or not self.rendered_settled:
+            self.update(surface, self.vote())
+            self.rendered_settled = self.settled()
+            self.dirty = False
+
+        # Update draw buffer
+        self.record()
+
+    def present(self, surface, screen):
+        """Render a vote screen produced elsewhere (e.g. another thread)."""
+        self.update(surface, screen)
+
+    def update(self, surface, screen):
+        """Write the rows of screen that changed since last update."""
+        pixels = pygame.surfarray.pixels2d(surface)  # (width, height) view
+        colour = GFX.OFF_COLOUR, GFX.ON_COLOUR
+        palette = np.array(
+            [surface.map_rgb((c, c, c)) for c in colour], pixels.dtype
+        )
+
+        if self.rendered is not None and self.rendered.shape == screen.shape:
+            rows = np.flatnonzero((screen != self.rendered).any(axis=1))
+        else:
+            pixels[:] = palette[0]  # Border
+            rows = np.arange(screen.shape[0])
+        self.rendered = screen
+
+        if rows.size:
+            top, bottom = rows[0], rows[-1] + 1
+            block = self.scaled_view(pixels, screen.shape)[:, :, top:bottom, :]
+            block[...] = palette[screen[top:bottom].T][:, None, :, None]
+
+        del pixels  # Unlock surface
+
+    @staticmethod
+    def scaled_view(pixels, shape):
+        """View pixels as (width, scale, height, scale) screen pixel blocks."""
+        height, width = shape
+        win_width, win_height = pixels.shape
+        scale = min(win_width // width, win_height // height)
+        x0 = (win_width - scale * width) // 2
+        y0 = (win_height - scale * height) // 2
+
+        area = pixels[x0 : x0 + scale * width, y0 : y0 + scale * height]
+        sx, sy = area.strides
+        return np.lib.stride_tricks.as_strided(
+            area,
+            shape=(width, scale, height, scale),
+            strides=(sx * scale, sx, sy * scale, sy),
+        )
+
+
+class SDLKeyboard(HexKeyboard):
+    """Keyboard driven by pygame key events."""
+
+    key_map = {
+        pygame.K_1: 0x1,
+        pygame.K_2: 0x2,
+        pygame.K_3: 0x3,
+        pygame.K_4: 0xC,
+        pygame.K_q: 0x4,
+        pygame.K_w: 0x5,
+        pygame.K_e: 0x6,
+        pygame.K_r: 0xD,
+        pygame.K_a: 0x7,
+        pygame.K_s: 0x8,
+        pygame.K_d: 0x9,
+        pygame.K_f: 0xE,
+        pygame.K_z: 0xA,
+        pygame.K_x: 0x0,
+        pygame.K_c: 0xB,
+        pygame.K_v: 0xF,
+        pygame.K_p: HexKeyboard.PAUSE,
+        pygame.K_TAB: HexKeyboard.RESET,
+        pygame.K_ESCAPE: HexKeyboard.EXIT,
+    }
+
+    def key_event(self, event):
+        """Return (key, pressed) for a mapped key event, else None."""
+        if event.type in (pygame.KEYDOWN, pygame.KEYUP) and event.key in self.key_map:
+            return self.key_map[event.key], event.type == pygame.KEYDOWN
+        return None
+
+    def update_key_press(self, event):
+        if event.type == pygame.KEYDOWN and event.key in self.key_map:
+            self.press(self.key_map[event.key])
+
+    def update_key_release(self, event):
+        if event.type == pygame.KEYUP and event.key in self.key_map:
+            self.release(self.key_map[event.key])
+
+
+class SDLBackend(HeadlessBackend):
+    """Backend taking input from pygame and rendering to a pygame surface.
+
+    Parameters
+    ----------
+    smooth : bool
+        Render with the OpenCV smoothing filter (SDLGFX) rather than plain
+        integer upscaling (SurfaceGFX).
+    """
+
+    def __init__(self, smooth=True):
+        self.smooth = smooth
+
+    def create_gfx(self):
+        return SDLGFX() if self.smooth else SurfaceGFX()
+
+    def create_keyboard(self):
+        return SDLKeyboard()
@@ -0,0 +1,334 @@
+"""Multi-session frame streaming server.
+
+Runs many headless machines in one asyncio event loop, one per TCP client,
+and streams their screens. Sessions are scheduled cooperatively: every 60 Hz
+tick, each session applies the key events received since the last tick,
+emulates one frame and sends the screen rows that changed since the frame
+last sent to its client. Each session's CPU time is metered, to size hosts.
+
+    python -m chippy.server [--port 8765] [--workers N]
+
+With --workers, N server processes share the port (SO_REUSEPORT) and the
+kernel spreads clients between them.
+
+Protocol: messages in both directions are a 4 byte little-endian length
+followed by the payload, whose first byte is the message type.
+
+Client to server:
+    b"L" + ROM path (e.g. b"games/chip8/BRIX")  Start the session (first).
+    b"K" + key + pressed                        Key event (two bytes).
+
+Server to client:
+    b"F" + frame (uint32) + width + height + rows, then for each changed
+    row: its index, its number of runs and the runs. A row is run-length
+    encoded as the lengths of its alternating OFF / ON pixel runs, starting
+    with OFF (so possibly with a zero first run). Rows are diffed against
+    the previous frame sent; on a resolution change the client should clear
+    its screen, and all rows that are ON are sent.
+    b"E" + message                              Error; the session ends.
+
+Capacity reports and session failures are logged (logger "chippy.server").
+"""
+import asyncio
+import itertools
+import logging
+import os
+import struct
+import time
+
+from . import catalog, core, scheduler
+
+MSG_LOAD = b"L"
+MSG_KEY = b"K"
+MSG_FRAME = b"F"
+MSG_ERROR = b"E"
+
+_LENGTH = struct.Struct("<I")
+# type, frame, width, height, changed rows
+_FRAME = struct.Struct("<cIBBB")
+# row index, number of runs
+_ROW = struct.Struct("<BB")
+
+MAX_MESSAGE = 1024  # Longest message accepted from clients (bytes)
+MAX_BACKLOG = 1 << 16  # Unsent bytes beyond which a client's frames are skipped
+
+log = logging.getLogger(__name__)
+
+
+def encode_row(row, width):
+    """Run-length encode a packed screen row (cf. graphics.PackedGFX)."""
+    bits = format(row, "0{}b".format(width))
+    runs = [len(list(run)) for _, run in itertools.groupby(bits)]
+    if bits[0] == "1":
+        runs.insert(0, 0)
+    return bytes(runs)
+
+
+def decode_row(runs):
+    """Return the packed row for runs produced by encode_row."""
+    row = 0
+    for i, run in enumerate(runs):
+        row = (row << run) | ((1 << run) - 1 if i % 2 else 0)
+    return row
+
+
+def decode_frame(payload):
+    """Return (frame, width, height, {row index: packed row}) of a message."""
+    _, frame, width, height, count = _FRAME.unpack_from(payload)
+    offset = _FRAME.size
+    rows = {}
+    for _ in range(count):
+        index, nruns = _ROW.unpack_from(payload, offset)
+        offset += _ROW.size
+        rows[index] = decode_row(payload[offset : offset + nruns])
+        offset += nruns
+    return frame, width, height, rows
+
+
+class Session(object):
+    """A headless machine streaming its screen to one client.
+
+    Parameters
+    ----------
+    game_path : str
+        ROM to run.
+    writer : asyncio.StreamWriter
+        Connection to the client.
+    ips : int
+        Instructions per second.
+    """
+
+    def __init__(self, game_path, writer, ips=scheduler.IPS):
+        self.machine = core.Machine()
+        self.machine.load_game(game_path)
+        self.clock = scheduler.Scheduler(self.machine, ips, turbo=True)
+        self.writer = writer
+
+        self.sent = []  # Rows of the frame last sent
+        self.cpu = 0.0  # CPU time used (seconds)
+        self.skipped = 0  # Frames not sent to a slow client
+        self.behind = False  # Client missing changes (frames skipped)
+
+    def key(self, key, pressed):
+        keyboard = self.machine.keyboard
+        if key >= keyboard.KEYS:
+            return
+        if pressed:
+            keyboard.press(key)
+        else:
+            keyboard.release(key)
+
+    def tick(self):
+        """Emulate a frame and send the rows changed since the last sent."""
+        start = time.thread_time()
+        gfx = self.machine.gfx
+        self.clock.emulate_frame()
+
+        if gfx.dirty or not gfx.settled() or self.behind:
+            rows = gfx.vote_rows()
+            message = self.frame_message(rows, gfx.width)
+            gfx.dirty = False
+
+            if message is None:
+                self.behind = False
+            elif self.writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+                self.skipped += 1  # Slow client: catch up on a later frame
+                self.behind = True
+            else:
+                self.writer.write(_LENGTH.pack(len(message)) + message)
+                self.sent = rows
+                self.behind = False
+        gfx.record()
+
+        self.cpu += time.thread_time() - start
+
+    def frame_message(self, rows, width):
+        """Return the frame message for rows, or None if nothing changed."""
+        sent = self.sent
+        if len(sent) != len(rows):  # New resolution: diff against a blank
+            sent = [0] * len(rows)
+        elif sent == rows:
+            return None
+
+        changed = [i for i, (row, old) in enumerate(zip(rows, sent)) if row != old]
+        parts = [
+            _FRAME.pack(MSG_FRAME, self.clock.frames, width, len(rows), len(changed))
+        ]
+        for i in changed:
+            runs = encode_row(rows[i], width)
+            parts.append(_ROW.pack(i, len(runs)) + runs)
+        return b"".join(parts)
+
+    def stats(self):
+        frames = self.clock.frames
+        return {
+            "game": self.machine.game,
+            "frames": frames,
+            "instructions": self.clock.instructions,
+            "cpu": self.cpu,
+            "cpu_per_frame": self.cpu / frames if frames else 0.0,
+            "skipped": self.skipped,
+        }
+
+
+class FrameServer(object):
+    """Serve sessions over TCP, ticking them all at a fixed rate.
+
+    Parameters
+    ----------
+    ips : int
+        Instructions per second of each session.
+    fps : int
+        Tick rate (frames per second).
+    stats_period : float
+        Seconds between capacity reports (0: none).
+    """
+
+    def __init__(self, ips=scheduler.IPS, fps=scheduler.FPS, stats_period=10.0):
+        self.ips = ips
+        self.fps = fps
+        self.stats_period = stats_period
+        self.sessions = []
+        self.ticks = 0
+        self.cpu = 0.0  # CPU time spent ticking sessions
+
+    async def handle(self, reader, writer):
+        """Run a client connection: load its ROM, then apply its key events."""
+        session = None
+        try:
+            message = await self.read_message(reader)
+            game_path = message[1:].decode("utf-8", "replace")
+            if message[:1] != MSG_LOAD or not self.allowed(game_path):
+                self.send_error(writer, "Expected a bundled ROM to load.")
+                return
+
+            session = Session(game_path, writer, self.ips)
+            self.sessions.append(session)
+
+            while True:
+                message = await self.read_message(reader)
+                if message[:1] == MSG_KEY and len(message) == 3:
+                    session.key(message[1], message[2])
+
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            if session in self.sessions:
+                self.sessions.remove(session)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def read_message(self, reader):
+        (length,) = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+        if length > MAX_MESSAGE:
+            raise ValueError("Message too long.")
+        return await reader.readexactly(length)
+
+    def send_error(self, writer, text):
+        message = MSG_ERROR + text.encode("utf-8")
+        writer.write(_LENGTH.pack(len(message)) + message)
+
+    @staticmethod
+    def allowed(game_path):
+        """Whether game_path names a ROM bundled with the package."""
+        return not os.path.isabs(game_path) and catalog.lookup(game_path) is not None
+
+    async def tick_loop(self):
+        """Tick every session once per frame period, forever."""
+        loop = asyncio.get_event_loop()
+        period = 1.0 / self.fps
+        deadline = loop.time()
+        last_report = time.perf_counter()
+
+        while True:
+            start = time.thread_time()
+            for session in list(self.sessions):
+                try:
+                    session.tick()
+                except Exception:  # Only this client's session ends
+                    log.exception("Session of %s failed", session.machine.game)
+                    self.drop(session, "Emulation failed.")
+            self.cpu += time.thread_time() - start
+            self.ticks += 1
+
+            now = time.perf_counter()
+            if self.stats_period and now - last_report >= self.stats_period:
+                log.info(self.report())
+                last_report = now
+
+            deadline = max(deadline + period, loop.time())  # No catching up
+            await asyncio.sleep(deadline - loop.time())
+
+    def drop(self, session, text):
+        """End a session: send its client an error and close the connection."""
+        self.sessions.remove(session)
+        try:
+            self.send_error(session.writer, text)
+        except ConnectionError:
+            pass
+        session.writer.close()
+
+    def report(self):
+        """Return a one line summary of the load and estimated capacity."""
+        per_tick = self.cpu / self.ticks if self.ticks else 0.0
+        cpu = sum(session.cpu for session in self.sessions)
+        frames = sum(session.clock.frames for session in self.sessions)
+        per_frame = cpu / frames if frames else 0.0
+        capacity = int(1.0 / (self.fps * per_frame)) if per_frame else 0
+        return "{} sessions, {:.2f} ms CPU per tick, ~{} sessions/core".format(
+            len(self.sessions), 1000 * per_tick, capacity
+        )
+
+    async def serve(self, host="127.0.0.1", port=8765, reuse_port=False):
+        server = await asyncio.start_server(
+            self.handle, host, port, reuse_port=reuse_port or None
+        )
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.tick_loop())
+
+
+def run_server(host, port, ips, reuse_port=False):
+    asyncio.run(FrameServer(ips).serve(host, port, reuse_port))
+
+
+# Launch from command line
+if __name__ == "__main__":
+    import argparse
+    import multiprocessing
+
+    parser = argparse.ArgumentParser(description="CHIP8 / SCHIP frame server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--ips",
+        type=int,
+        default=scheduler.IPS,
+        help="Instructions per second (default: {}).".format(scheduler.IPS),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Server processes sharing the port.",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(process)d %(message)s"
+    )
+    if args.workers == 1:
+        run_server(args.host, args.port, args.ips)
+    else:
+        workers = [
+            multiprocessing.Process(
+                target=run_server, args=(args.host, args.port, args.ips, True)
+            )
+            for _ in range(args.workers)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
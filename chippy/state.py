@@ -0,0 +1,302 @@
+"""Machine save states and rewind.
+
+A save state is a versioned binary snapshot of everything a machine needs to
+resume: memory, registers, stack, timers, display (frame, history and
+resolution), keyboard state, random number generator state and SCHIP user
+flags. The rewind buffer stores periodic save states as keyframes and, in
+between, only the state that changes from frame to frame.
+"""
+import collections
+import struct
+
+import numpy as np
+
+from .graphics import GFX, SCHIP_WIDTH, PackedGFX
+
+MAGIC = b"CHPS"
+VERSION = 3
+STACK_SIZE = 16  # Subroutine levels saved
+
+# magic, version, I, pc, delay timer, sound timer, stack depth
+_HEADER = struct.Struct("<4sBHHHHB")
+_STACK = struct.Struct("<{}H".format(STACK_SIZE))
+# width, height, collision flag, history head, frames since last change
+_GFX = struct.Struct("<BBBBH")
+# Mersenne Twister state words and position
+_RNG = struct.Struct("<625I")
+
+
+def dumps(machine):
+    """Return the state of machine as bytes."""
+    gfx = machine.gfx
+    depth = len(machine.stack)
+    if depth > STACK_SIZE:
+        message = "Stack deeper than {} cannot be saved.".format(STACK_SIZE)
+        raise ValueError(message)
+
+    stack = list(machine.stack) + [0] * (STACK_SIZE - depth)
+    header = _HEADER.pack(
+        MAGIC,
+        VERSION,
+        machine.I,
+        machine.pc,
+        machine.delay_timer,
+        machine.sound_timer,
+        depth,
+    )
+    display = _GFX.pack(
+        gfx.width,
+        gfx.height,
+        1 if gfx.collision_flag else 0,
+        gfx.head,
+        min(gfx.quiet, 0xFFFF),
+    )
+    return b"".join(
+        [
+            header,
+            _STACK.pack(*stack),
+            bytes(machine.V),
+            bytes(machine.memory),
+            display,
+            frame_bytes(gfx),
+            np.packbits(machine.keyboard.state).tobytes(),
+            _RNG.pack(*machine.rng.getstate()[1]),
+            bytes(machine.flags),
+        ]
+    )
+
+
+def loads(machine, data):
+    """Restore the state of machine from bytes produced by dumps."""
+    magic, version, I, pc, delay, sound, depth = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a chippy save state.")
+    if version != VERSION:
+        raise ValueError("Unsupported save state version: {}".format(version))
+
+    offset = _HEADER.size
+    stack = _STACK.unpack_from(data, offset)
+    offset += _STACK.size
+
+    machine.I = I
+    machine.pc = pc
+    machine.delay_timer = delay
+    machine.sound_timer = sound
+    machine.stack = list(stack[:depth])
+
+    registers = len(machine.V)
+    machine.V = bytearray(data[offset : offset + registers])
+    offset += registers
+
+    # New memory, so that execution engines caching code see the change
+    memory_size = len(machine.memory)
+    machine.clean_memory()
+    machine.memory[:] = data[offset : offset + memory_size]
+    offset += memory_size
+
+    gfx = machine.gfx
+    width, height, collision, head, quiet = _GFX.unpack_from(data, offset)
+    offset += _GFX.size
+
+    gfx.set_resolution("high" if width == SCHIP_WIDTH else "low")
+    gfx.collision_flag = bool(collision)
+
+    def unpack(shape):
+        nbytes = int(np.prod(shape)) // 8
+        bits = np.frombuffer(data, np.uint8, nbytes, offset)
+        return np.unpackbits(bits).reshape(shape), offset + nbytes
+
+    frame, offset = unpack((height, width))
+    history, offset = unpack((GFX.DEPTH - 1, height, width))
+    gfx.load_frames(frame, history, head)
+    gfx.quiet = quiet
+
+    keyboard = machine.keyboard
+    nbytes = (len(keyboard.state) + 7) // 8
+    bits = np.frombuffer(data, np.uint8, nbytes, offset)
+    keyboard.state = np.unpackbits(bits)[: len(keyboard.state)].astype(bool)
+    offset += nbytes
+
+    rng_version = machine.rng.getstate()[0]
+    machine.rng.setstate((rng_version, _RNG.unpack_from(data, offset), None))
+    offset += _RNG.size
+
+    flags = len(machine.flags)
+    machine.flags = bytearray(data[offset : offset + flags])
+
+
+def save(machine, path):
+    """Write the state of machine to file path."""
+    with open(path, "wb") as state_file:
+        state_file.write(dumps(machine))
+
+
+def load(machine, path):
+    """Restore the state of machine from file path."""
+    with open(path, "rb") as state_file:
+        loads(machine, state_file.read())
+
+
+class Rewind(object):
+    """Ring buffer of recent machine states, for rewinding.
+
+    Every keyframe_interval-th capture is a full save state (dumps). The
+    others only hold what changes from frame to frame: registers, stack,
+    timers, keys, the frame as packed rows, the bytes of memory that differ
+    from the keyframe's (as index / value arrays) and the RNG state, read
+    only when numbers were drawn. They leave the display history out:
+    rewinding to them restarts the history (and flicker vote) from the frame.
+
+    Parameters
+    ----------
+    machine : core.Machine
+        The machine to capture.
+    frames : int
+        Number of states kept (e.g. 5 seconds at 60 frames per second).
+    keyframe_interval : int
+        Number of captures between full snapshots.
+    """
+
+    def __init__(self, machine, frames=300, keyframe_interval=60):
+        self.machine = machine
+        self.keyframe_interval = keyframe_interval
+        self.states = collections.deque(maxlen=frames)
+        self.keyframe = None  # (save state, memory) of the latest keyframe
+        self.since_keyframe = 0
+        self.rng_state = None  # RNG state, if changed since the keyframe
+        self.rng_changes = 0
+
+    def __len__(self):
+        return len(self.states)
+
+    def capture(self):
+        """Record the current state of the machine."""
+        machine = self.machine
+        rng = machine.rng
+
+        if self.keyframe is None or self.since_keyframe >= self.keyframe_interval:
+            self.keyframe = (dumps(machine), np.array(machine.memory_view))
+            self.since_keyframe = 0
+            self.rng_state = None
+            self.rng_changes = rng.changes
+            self.states.append((self.keyframe, None))
+            return
+
+        if rng.changes != self.rng_changes:
+            self.rng_state = rng.getstate()
+            self.rng_changes = rng.changes
+
+        memory = self.keyframe[1]
+        changed = np.flatnonzero(machine.memory_view != memory).astype(np.uint16)
+        gfx = machine.gfx
+        delta = (
+            machine.I,
+            machine.pc,
+            machine.delay_timer,
+            machine.sound_timer,
+            tuple(machine.stack),
+            bytes(machine.V),
+            bytes(machine.flags),
+            changed,
+            machine.memory_view[changed],
+            gfx.width,
+            gfx.collision_flag,
+            pack_frame(gfx),
+            machine.keyboard.state.tobytes(),
+            self.rng_state,
+        )
+        self.states.append((self.keyframe, delta))
+        self.since_keyframe += 1
+
+    def rewind(self, frames=1):
+        """Restore the state captured frames captures ago; return success.
+
+        Captures more recent than the restored state are discarded.
+        """
+        if frames < 1 or frames > len(self.states):
+            return False
+
+        for _ in range(frames - 1):
+            self.states.pop()
+        (data, _), delta = self.states.pop()
+
+        machine = self.machine
+        loads(machine, data)
+        if delta is not None:
+            (
+                machine.I,
+                machine.pc,
+                machine.delay_timer,
+                machine.sound_timer,
+                stack,
+                V,
+                flags,
+                changed,
+                values,
+                width,
+                collision,
+                frame,
+                keys,
+                rng_state,
+            ) = delta
+
+            machine.stack = list(stack)
+            machine.V = bytearray(V)
+            machine.flags = bytearray(flags)
+            machine.memory_view[changed] = values
+            machine.keyboard.state = np.frombuffer(keys, bool).copy()
+            if rng_state is not None:
+                machine.rng.setstate(rng_state)
+
+            gfx = machine.gfx
+            if gfx.width != width:
+                gfx.set_resolution("high" if width == SCHIP_WIDTH else "low")
+            frame = unpack_frame(gfx, frame)
+            history = np.broadcast_to(frame, (GFX.DEPTH - 1,) + frame.shape)
+            gfx.load_frames(frame, history, 0)
+            gfx.collision_flag = collision
+
+        # Continue capturing from a fresh keyframe
+        self.keyframe = None
+        return True
+
+    def nbytes(self):
+        """Approximate memory used by the captured states."""
+        keyframes = {}
+        total = 0
+        for keyframe, delta in self.states:
+            data, memory = keyframe
+            keyframes[id(keyframe)] = len(data) + memory.nbytes
+            if delta is not None:
+                stack, V, flags, changed, values = delta[4:9]
+                width = delta[9]
+                total += 8 + 2 * len(stack) + len(V) + len(flags)
+                total += changed.nbytes + values.nbytes
+                total += width * (width // 2) // 8  # Frame bits
+        return total + sum(keyframes.values())
+
+
+def frame_bytes(gfx):
+    """Return the frame and history of a display as bits (1 bit per pixel)."""
+    if isinstance(gfx, PackedGFX):  # Rows are already bits
+        nbytes = gfx.width // 8
+        rows = list(gfx.rows)
+        for past in gfx.row_history:
+            rows.extend(past)
+        return b"".join([row.to_bytes(nbytes, "big") for row in rows])
+    return np.packbits(gfx.frame).tobytes() + np.packbits(gfx.history).tobytes()
+
+
+def pack_frame(gfx):
+    """Return the frame of a display compactly (packed rows or bits)."""
+    if isinstance(gfx, PackedGFX):
+        return tuple(gfx.rows)
+    return np.packbits(gfx.frame).tobytes()
+
+
+def unpack_frame(gfx, packed):
+    """Return the (height, width) frame packed by pack_frame."""
+    if isinstance(gfx, PackedGFX):
+        return gfx.expand(packed)
+    bits = np.unpackbits(np.frombuffer(packed, np.uint8))
+    return bits.reshape(gfx.height, gfx.width)
@@ -0,0 +1,88 @@
+"""Emulation on a worker thread, decoupled from rendering.
+
+The worker runs the machine under a Scheduler and publishes each emulated
+frame's vote screen through a FrameBuffer, which the render thread picks up
+at its own pace. Key events travel the other way through a queue and are
+applied to the keyboard on the worker, between frames. A slow render thread
+therefore never stalls emulation, and the NumPy / OpenCV rendering work
+(which releases the GIL) overlaps with it.
+"""
+import queue
+import threading
+
+
+class FrameBuffer(object):
+    """Latest-frame handoff between the emulation and render threads.
+
+    The writer publishes a new screen array for each frame and never writes
+    to it again; the reader takes the most recent one. Since the swap is a
+    single reference assignment, neither side blocks the other, and frames
+    the reader was too slow for are simply skipped.
+    """
+
+    def __init__(self):
+        self.latest = (0, None)  # (sequence number, screen)
+
+    def publish(self, screen):
+        self.latest = (self.latest[0] + 1, screen)
+
+    def take(self, sequence=0):
+        """Return (sequence, screen) if newer than sequence, else None."""
+        latest = self.latest
+        return latest if latest[0] > sequence else None
+
+
+class EmulationThread(threading.Thread):
+    """Worker thread running a machine's scheduler.
+
+    Parameters
+    ----------
+    machine : core.Machine
+        The machine to run; its gfx is only written by this thread.
+    scheduler : scheduler.Scheduler
+        Scheduler pacing the machine.
+    recorder : movie.MovieWriter, optional
+        Records the key events as they are applied.
+    """
+
+    def __init__(self, machine, scheduler, recorder=None):
+        super(EmulationThread, self).__init__(name="chippy-emulation")
+        self.daemon = True
+        self.machine = machine
+        self.scheduler = scheduler
+        self.recorder = recorder
+        self.frames = FrameBuffer()
+        self.keys = queue.Queue()  # (key, pressed) events
+        self.stopping = threading.Event()
+
+    def send_key(self, key, pressed):
+        self.keys.put((key, pressed))
+
+    def stop(self):
+        self.stopping.set()
+
+    def poll_keys(self):
+        keyboard = self.machine.keyboard
+        while True:
+            try:
+                key, pressed = self.keys.get_nowait()
+            except queue.Empty:
+                return
+
+            if self.recorder is not None:
+                self.recorder.record(self.scheduler.frames, key, pressed)
+            if pressed:
+                keyboard.press(key)
+            else:
+                keyboard.release(key)
+
+    def run(self):
+        gfx = self.machine.gfx
+        keyboard = self.machine.keyboard
+
+        while not (self.stopping.is_set() or keyboard.is_exit()):
+            self.poll_keys()
+            if self.scheduler.tick():
+                self.frames.publish(gfx.vote())
+                gfx.record()
+            self.scheduler.wait()
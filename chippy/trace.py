@@ -0,0 +1,188 @@
+"""Binary execution traces.
+
+A Tracer attached to a machine records every instruction executed through
+its decode table (cf. profiler) as a fixed-width 16 byte record: cycle, pc,
+opcode, I after execution, and the lowest numbered register the instruction
+changed with its new value (NO_REGISTER if none). Records are packed into
+preallocated chunks, which a background thread writes to disk, so tracing
+only adds a small constant cost per instruction. As for profiling, only
+stepwise execution (Machine.emulate_cycle) is traced, not translated blocks,
+and idle loops are not fast-forwarded while a tracer is attached.
+
+Traces are read back as a memory-mapped NumPy record array (load) or as a
+lazily filtered stream of records (records).
+"""
+import functools
+import queue
+import struct
+import threading
+
+import numpy as np
+
+from .instructions import InstructionSet, WrappedDecodeTable, decode_table
+
+MAGIC = b"CHPT"
+VERSION = 1
+NO_REGISTER = 0xFF
+
+# magic, version (padded to the record size)
+_HEADER = struct.Struct("<4sB11x")
+# cycle, pc, opcode, I, register, value
+_RECORD = struct.Struct("<QHHHBB")
+
+RECORD = np.dtype(
+    [
+        ("cycle", "<u8"),
+        ("pc", "<u2"),
+        ("opcode", "<u2"),
+        ("I", "<u2"),
+        ("register", "u1"),
+        ("value", "u1"),
+    ]
+)
+
+
+class Tracer(object):
+    """Write a binary trace of the instructions a machine executes.
+
+    Parameters
+    ----------
+    path : str
+        Trace file written.
+    chunk : int
+        Records per chunk written to disk.
+    buffers : int
+        Chunks preallocated; emulation waits for the writer if all are full.
+    instruction_set : type
+        InstructionSet (sub)class traced until attached; attached machines
+        are traced with their own instruction set (quirk profile).
+    """
+
+    def __init__(self, path, chunk=1 << 16, buffers=4, instruction_set=InstructionSet):
+        self.file = open(path, "wb")
+        self.file.write(_HEADER.pack(MAGIC, VERSION))
+
+        self.chunk_size = chunk * _RECORD.size
+        self.free = queue.Queue()
+        for _ in range(buffers):
+            self.free.put(bytearray(self.chunk_size))
+        self.full = queue.Queue()
+        self.buffer = self.free.get()
+        self.offset = 0
+        self.cycle = 0
+
+        self.writer = threading.Thread(target=self.write_chunks, name="chippy-trace")
+        self.writer.daemon = True
+        self.writer.start()
+        self.decode_table = WrappedDecodeTable(self.wrap, instruction_set)
+
+    def attach(self, machine):
+        """Trace the instructions machine executes from now on."""
+        instruction_set = machine.decode_table.instruction_set
+        if instruction_set is not self.decode_table.instruction_set:
+            self.decode_table = WrappedDecodeTable(self.wrap, instruction_set)
+        machine.decode_table = self.decode_table
+
+    def detach(self, machine):
+        """Stop tracing machine (restore its shared decode table)."""
+        machine.decode_table = decode_table(machine.quirks)
+
+    def wrap(self, handler):
+        """Return handler wrapped to append a trace record."""
+        code = handler.__self__.opcode.code
+        pack_into = _RECORD.pack_into
+        record_size = _RECORD.size
+
+        @functools.wraps(handler)
+        def traced(machine):
+            before = bytes(machine.V)
+            handler(machine)
+            machine.idle = 0  # Dispatch every idle loop iteration
+
+            V = machine.V
+            register, value = NO_REGISTER, 0
+            if V != before:
+                register = next(i for i in range(len(V)) if V[i] != before[i])
+                value = V[register]
+
+            pack_into(
+                self.buffer,
+                self.offset,
+                self.cycle,
+                (machine.pc - 2) & 0xFFFF,
+                code,
+                machine.I & 0xFFFF,
+                register,
+                value,
+            )
+            self.cycle += 1
+            self.offset += record_size
+            if self.offset == self.chunk_size:
+                self.flush()
+
+        return traced
+
+    def flush(self):
+        """Hand the records buffered so far to the writer thread."""
+        if self.offset:
+            self.full.put((self.buffer, self.offset))
+            self.buffer = self.free.get()
+            self.offset = 0
+
+    def write_chunks(self):
+        while True:
+            buffer, nbytes = self.full.get()
+            if buffer is None:
+                return
+            self.file.write(memoryview(buffer)[:nbytes])
+            self.free.put(buffer)
+
+    def close(self):
+        """Write out the remaining records and close the trace file."""
+        self.flush()
+        self.full.put((None, 0))
+        self.writer.join()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load(path):
+    """Return a trace as a (memory-mapped) record array, cf. RECORD."""
+    with open(path, "rb") as trace:
+        magic, version = _HEADER.unpack(trace.read(_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("Not a chippy trace.")
+    if version != VERSION:
+        raise ValueError("Unsupported trace version: {}".format(version))
+
+    try:
+        return np.memmap(path, RECORD, "r", offset=_HEADER.size)
+    except ValueError:  # No records
+        return np.zeros(0, RECORD)
+
+
+def records(path, pc=None, opcode=None, mask=0xFFFF, register=None, chunk=1 << 16):
+    """Generate the (cycle, pc, opcode, I, register, value) records of a trace.
+
+    Records can be filtered by pc, by opcode (compared under mask, e.g.
+    opcode=0xD000, mask=0xF000 for sprite draws) and by changed register.
+    The trace is read chunk by chunk.
+    """
+    trace = load(path)
+    for start in range(0, len(trace), chunk):
+        block = trace[start : start + chunk]
+        keep = np.ones(len(block), bool)
+        if pc is not None:
+            keep &= block["pc"] == pc
+        if opcode is not None:
+            keep &= (block["opcode"] & mask) == (opcode & mask)
+        if register is not None:
+            keep &= block["register"] == register
+
+        for record in block[keep].tolist():
+            yield record
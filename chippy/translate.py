@@ -0,0 +1,247 @@
+"""Basic-block translation engine.
+
+Straight-line runs of instructions (basic blocks) are translated into single
+generated Python functions, with operands inlined as constants, and cached by
+start address. Running a cached block executes every instruction in it with
+one call, instead of one fetch / decode / execute round-trip per instruction.
+
+Blocks end on any instruction that can change control flow, draw, read the
+keyboard or write to memory, so the observable behaviour is that of the
+stepwise interpreter (Machine.emulate_cycle). Only handlers of the default
+instruction set are inlined; those a quirk profile overrides are called.
+"""
+from .instructions import InstructionSet
+
+BLOCK_SIZE = 32  # Maximum number of instructions in a block
+
+# Opcodes (as masks, cf. InstructionSet) that terminate a block.
+_TERMINATORS = set(
+    [
+        "_00EE", "_00FD", "_1MMM", "_2MMM", "_3MMM", "_4MMM", "_5MMM",
+        "_9MMM", "_BMMM", "_DMMM", "_EM9E", "_EMA1", "_FM0A", "_FM33",
+        "_FM55", "_NOP",
+    ]
+)
+
+# Opcodes that write to memory, as {mask: number of bytes written(X)}.
+_MEMORY_WRITERS = {
+    "_FM33": lambda X: 3,
+    "_FM55": lambda X: X + 1,
+}
+
+
+def _code_at(memory, address):
+    return (memory[address] << 8) | memory[address + 1]
+
+
+def _inline(name, X, Y, NN, NNN):
+    """Return the source lines for an instruction, or None if not inlined."""
+    VX, VY, VF = "V[{}]".format(X), "V[{}]".format(Y), "V[15]"
+
+    if name == "_6MMM":
+        return ["{} = {:#04x}".format(VX, NN)]
+    if name == "_7MMM":
+        return ["{} = ({} + {:#04x}) & 0xFF".format(VX, VX, NN)]
+    if name == "_AMMM":
+        return ["machine.I = {:#05x}".format(NNN)]
+    if name == "_8MM0":
+        return ["{} = {}".format(VX, VY)]
+
+    ops = {"_8MM1": "|", "_8MM2": "&", "_8MM3": "^"}
+    if name in ops:
+        return ["{} = {} {} {}".format(VX, VX, ops[name], VY), VF + " = 0"]
+
+    # Flag setting arithmetic is only inlined when VF is not an operand.
+    if 0xF in (X, Y):
+        return None
+
+    if name == "_8MM4":
+        return [
+            "s = {} + {}".format(VX, VY),
+            "{} = s & 0xFF".format(VX),
+            "{} = s >> 8".format(VF),
+        ]
+    if name == "_8MM5":
+        return [
+            "{} = {} >= {}".format(VF, VX, VY),
+            "{} = ({} - {}) & 0xFF".format(VX, VX, VY),
+        ]
+    if name == "_8MM6":
+        return ["{} = {} & 0x1".format(VF, VX), "{} = {} >> 1".format(VX, VX)]
+    if name == "_8MM7":
+        return [
+            "{} = {} >= {}".format(VF, VY, VX),
+            "{} = ({} - {}) & 0xFF".format(VX, VY, VX),
+        ]
+    if name == "_8MME":
+        return [
+            "{} = {} >> 7".format(VF, VX),
+            "{} = ({} << 1) & 0xFF".format(VX, VX),
+        ]
+    return None
+
+
+class Block(object):
+    """A translated basic block.
+
+    Parameters
+    ----------
+    start, stop : int
+        Memory range [start, stop) the block was translated from.
+    size : int
+        Number of instructions in the block.
+    function : callable
+        The generated function, called with the machine.
+    source : str
+        The generated source code (for debugging).
+    """
+
+    def __init__(self, start, stop, size, function, source):
+        self.start = start
+        self.stop = stop
+        self.size = size
+        self.function = function
+        self.source = source
+
+
+class BlockTranslator(object):
+    """Execution engine running a machine's program as translated blocks.
+
+    Parameters
+    ----------
+    machine : core.Machine
+        The machine to run. Its game should already be loaded.
+    """
+
+    def __init__(self, machine):
+        self.machine = machine
+        self.flush()
+
+    def flush(self):
+        """Discard every cached block."""
+        self.blocks = {}
+        self._memory = self.machine.memory
+        self._owners = {}  # address -> set of block starts covering it
+
+    def invalidate(self, start, stop):
+        """Discard cached blocks overlapping memory range [start, stop)."""
+        owners = self._owners
+        for address in range(start, stop):
+            for block_start in owners.pop(address, ()):
+                block = self.blocks.pop(block_start, None)
+                if block is None:
+                    continue
+
+                for covered in range(block.start, block.stop):
+                    if covered in owners:
+                        owners[covered].discard(block_start)
+
+    def translate(self, start):
+        """Translate (and cache) the block starting at address start."""
+        machine = self.machine
+        body = []
+        namespace = {}
+        address = start
+        size = 0
+        end = len(machine.memory) - 1
+
+        while size < BLOCK_SIZE and address < end:
+            handler = machine.decode_table[_code_at(machine.memory, address)]
+            instruction = handler.__self__
+            name = handler.__name__
+            address += 2
+            size += 1
+
+            lines = None
+            if getattr(type(instruction), name) is getattr(InstructionSet, name):
+                lines = _inline(
+                    name, instruction.X, instruction.Y, instruction.NN, instruction.NNN
+                )
+            if lines is None or name in _TERMINATORS:
+                # Handlers may inspect the program counter, so commit it.
+                handler_id = "h{}".format(size)
+                namespace[handler_id] = handler
+                lines = [
+                    "machine.pc = {:#05x}".format(address),
+                    "{}(machine)".format(handler_id),
+                ]
+
+                if name in _MEMORY_WRITERS:
+                    nbytes = _MEMORY_WRITERS[name](instruction.X)
+                    lines.insert(0, "I = machine.I")
+                    lines.append("invalidate(I, I + {})".format(nbytes))
+
+            body.extend(lines)
+            if name in _TERMINATORS:
+                break
+
+        else:
+            body.append("machine.pc = {:#05x}".format(address))
+
+        source = "def block(machine):\n    V = machine.V\n    {}\n".format(
+            "\n    ".join(body)
+        )
+        namespace["invalidate"] = self.invalidate
+        exec(compile(source, "<block {:#05x}>".format(start), "exec"), namespace)
+
+        block = Block(start, address, size, namespace["block"], source)
+        self.blocks[start] = block
+        for covered in range(start, address):
+            self._owners.setdefault(covered, set()).add(start)
+        return block
+
+    def step(self):
+        """Emulate a single cycle, keeping the block cache coherent."""
+        machine = self.machine
+        handler = machine.decode_table[_code_at(machine.memory, machine.pc)]
+        I = machine.I
+        machine.emulate_cycle()
+
+        if handler.__name__ in _MEMORY_WRITERS:
+            nbytes = _MEMORY_WRITERS[handler.__name__](handler.__self__.X)
+            self.invalidate(I, I + nbytes)
+
+    def run(self, cycles):
+        """Emulate cycles instructions, a whole block at a time if possible.
+
+        Cycles that would otherwise be handled specially (reset, pause, exit)
+        and blocks larger than the remaining budget are emulated stepwise, so
+        running n cycles is equivalent to n calls of Machine.emulate_cycle.
+        Returns the number of instructions actually executed (cf. Machine.run).
+        """
+        machine = self.machine
+        keyboard = machine.keyboard
+
+        if machine.memory is not self._memory:  # New game loaded
+            self.flush()
+
+        debugger = machine.debugger
+        if debugger is not None and debugger.armed:
+            return debugger.run(cycles, self.step)
+
+        blocks = self.blocks
+        executed = cycles
+        machine.idle = 0
+        while cycles > 0:
+            if keyboard.is_reset() or keyboard.is_paused() or keyboard.is_exit():
+                self.step()
+                cycles -= 1
+                continue
+
+            pc = machine.pc
+            block = blocks.get(pc)
+            if block is None:
+                block = self.translate(pc)
+
+            if block.size <= cycles:
+                block.function(machine)
+                cycles -= block.size
+            else:
+                self.step()
+                cycles -= 1
+
+            if machine.idle:  # Fast-forward idle loops, as Machine.run
+                executed -= cycles - cycles % machine.idle
+                cycles %= machine.idle
+                machine.idle = 0
+        return executed
@@ -10,9 +10,10 @@ setuptools.setup(
     url="https://github.com/tjtnorton/chippy",
     packages=['chippy'],
     package_data={
-        'chippy': ['games/chip8/*', 'games/schip/*'],
+        'chippy': ['games/catalog.json', 'games/chip8/*', 'games/schip/*'],
     },
-    install_requires=['numpy', 'pygame', 'opencv-python'],
+    install_requires=['numpy'],
+    extras_require={'sdl': ['pygame'], 'smooth': ['opencv-python']},
     classifiers=[
         "Programming Language :: Python :: 2.7",
         "Programming Language :: Python :: 3",
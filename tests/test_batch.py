@@ -0,0 +1,75 @@
+import random
+
+import numpy as np
+import pytest
+
+from chippy import batch, bench, core
+
+FRAMES = 200
+CYCLES = 18  # Instructions per frame
+SEEDS = (1, 2, 3)
+
+
+def machine_state(machine):
+    gfx = machine.gfx
+    return (
+        machine.pc,
+        machine.I,
+        bytes(machine.V),
+        machine.delay_timer,
+        gfx.frame.astype(bool).tobytes(),
+    )
+
+
+def batch_state(machines, i):
+    height, width = machines.height[i], machines.width[i]
+    return (
+        int(machines.pc[i]),
+        int(machines.I[i]),
+        bytes(machines.V[i]),
+        int(machines.delay_timer[i]),
+        machines.screen[i, :height, :width].tobytes(),
+    )
+
+
+@pytest.mark.parametrize(
+    "game_path",
+    [
+        "games/chip8/BRIX",
+        "games/chip8/INVADERS",
+        "games/chip8/TETRIS",
+        "games/schip/ANT",
+    ],
+)
+def test_batch_matches_machines(game_path, monkeypatch):
+    # Draw CXNN numbers as Machine does, so that instances can be compared
+    rngs = [random.Random(seed) for seed in SEEDS]
+    monkeypatch.setattr(
+        batch.BatchMachine,
+        "_random",
+        lambda self, i: np.array([rngs[j].randint(0, 255) for j in i], np.uint8),
+    )
+
+    machines = []
+    for seed in SEEDS:
+        machine = core.Machine(seed=seed)
+        machine.load_game(game_path)
+        machines.append(machine)
+    lockstep = batch.BatchMachine(len(SEEDS))
+    lockstep.load_game(game_path)
+    scripts = [bench.key_script(FRAMES, seed) for seed in SEEDS]
+
+    for frame in range(FRAMES):
+        for i, (machine, script) in enumerate(zip(machines, scripts)):
+            bench.press_scripted(machine, script, frame)
+            lockstep.keys[i] = machine.keyboard.state[:16]
+            for _ in range(CYCLES):
+                machine.emulate_cycle()
+            machine.decrement_timers()
+        lockstep.run(CYCLES)
+        lockstep.decrement_timers()
+
+        for i, machine in enumerate(machines):
+            assert batch_state(lockstep, i) == machine_state(machine), (
+                "instance {} diverged on frame {}".format(i, frame)
+            )
@@ -0,0 +1,87 @@
+import pytest
+
+from chippy import core
+from chippy.instructions import QUIRKS, decode_table
+
+
+def make_machine(quirks=None):
+    machine = core.Machine(seed=0)
+    machine.decode_table = decode_table(quirks)
+    machine.quirks = quirks
+    return machine
+
+
+@pytest.mark.parametrize("quirks", [None] + sorted(QUIRKS))
+def test_store_load_registers_clipped_at_end_of_memory(quirks):
+    machine = make_machine(quirks)
+    machine.V[:] = bytes(range(1, 17))
+    machine.I = 0xFFE
+    machine.decode_table[0xF555](machine)  # FX55: only V0, V1 fit
+
+    assert len(machine.memory) == core.Machine.MEMORY
+    assert list(machine.memory[0xFFE:]) == [1, 2]
+
+    machine.V[:] = bytes(16)
+    machine.I = 0xFFE
+    machine.decode_table[0xF565](machine)  # FX65
+
+    assert len(machine.V) == core.Machine.REGISTERS
+    assert list(machine.V[:6]) == [1, 2, 0, 0, 0, 0]
+    machine.V[0xF] = 1  # The register file is still usable
+
+
+def execute(machine, *codes):
+    for code in codes:
+        machine.decode_table[code](machine)
+
+
+@pytest.mark.parametrize(
+    "quirks, expected",
+    [
+        (None, (0x40, 1)),
+        ("vip", (0x01, 1)),
+        ("chip48", (0x40, 1)),
+        ("schip", (0x40, 1)),
+    ],
+)
+def test_shift_source(quirks, expected):
+    machine = make_machine(quirks)
+    execute(machine, 0x6181, 0x6203, 0x8126)  # V1 = 0x81, V2 = 3, 8126
+    assert (machine.V[1], machine.V[0xF]) == expected
+
+
+@pytest.mark.parametrize(
+    "quirks, vf", [(None, 0), ("vip", 0), ("chip48", 5), ("schip", 5)]
+)
+def test_logic_resets_vf(quirks, vf):
+    machine = make_machine(quirks)
+    execute(machine, 0x6F05, 0x6103, 0x8121)  # VF = 5, 8121
+    assert machine.V[0xF] == vf
+
+
+@pytest.mark.parametrize(
+    "quirks, pc", [(None, 0x307), ("vip", 0x307), ("chip48", 0x309), ("schip", 0x309)]
+)
+def test_jump_with_offset(quirks, pc):
+    machine = make_machine(quirks)
+    execute(machine, 0x6005, 0x6307, 0xB302)  # V0 = 5, V3 = 7, B302
+    assert machine.pc == pc
+
+
+@pytest.mark.parametrize(
+    "quirks, I", [(None, 0x300), ("vip", 0x303), ("chip48", 0x302), ("schip", 0x300)]
+)
+def test_store_load_registers_index(quirks, I):
+    machine = make_machine(quirks)
+    execute(machine, 0xA300, 0xF255)
+    assert machine.I == I
+    execute(machine, 0xA300, 0xF265)
+    assert machine.I == I
+
+
+@pytest.mark.parametrize("quirks, rows", [(None, 2), ("schip", 1)])
+def test_low_resolution_scroll(quirks, rows):
+    machine = make_machine(quirks)
+    machine.memory[0x300] = 0x80
+    execute(machine, 0xA300, 0xD011, 0x00C2)  # Draw pixel (0, 0), scroll 2
+    assert machine.gfx.frame[rows, 0] and not machine.gfx.frame[0, 0]
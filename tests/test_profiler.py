@@ -0,0 +1,30 @@
+from chippy import core, profiler, trace
+
+
+def test_profiler_counts_idle_loop_iterations():
+    machine = core.Machine(seed=1)
+    machine.load_game("games/chip8/BRIX")
+    profile = profiler.Profiler()
+    profile.attach(machine)
+
+    executed = 0
+    for _ in range(300):
+        executed += machine.run(18)
+        machine.decrement_timers()
+
+    # No busy-wait iteration is fast-forwarded past the profiler
+    assert executed == 300 * 18
+    assert sum(profile.counts) == sum(profile.pc_hits) == executed
+
+
+def test_tracer_records_idle_loop_iterations(tmp_path):
+    machine = core.Machine(seed=1)
+    machine.load_game("games/chip8/BRIX")
+    path = str(tmp_path / "brix.trace")
+    with trace.Tracer(path) as tracer:
+        tracer.attach(machine)
+        for _ in range(300):
+            machine.run(18)
+            machine.decrement_timers()
+
+    assert len(trace.load(path)) == 300 * 18
@@ -0,0 +1,39 @@
+import random
+
+import pytest
+
+from chippy import server
+
+
+@pytest.mark.parametrize("width", [64, 128])
+def test_encode_decode_row_round_trip(width):
+    rng = random.Random(width)
+    full = (1 << width) - 1
+    rows = [0, full, 1, 1 << (width - 1), full // 3, full ^ 1]
+    rows += [rng.getrandbits(width) for _ in range(200)]
+    for row in rows:
+        runs = server.encode_row(row, width)
+        assert sum(runs) == width
+        assert all(runs[1:])  # Only the first (OFF) run may be empty
+        assert server.decode_row(runs) == row
+
+
+def test_frame_messages_rebuild_screen():
+    session = server.Session("games/chip8/BRIX", writer=None)
+    gfx = session.machine.gfx
+    screen = []
+    for _ in range(120):
+        session.clock.emulate_frame()
+        rows = gfx.vote_rows()
+        message = session.frame_message(rows, gfx.width)
+        if message is not None:
+            frame, width, height, changed = server.decode_frame(message)
+            assert frame == session.clock.frames
+            assert (width, height) == (gfx.width, len(rows))
+            if len(screen) != height:
+                screen = [0] * height
+            for index, row in changed.items():
+                screen[index] = row
+            session.sent = rows
+        gfx.record()
+        assert screen == rows
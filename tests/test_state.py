@@ -0,0 +1,70 @@
+from chippy import bench, core, scheduler, state
+
+
+def machine_state(machine):
+    """Return what a restored machine must reproduce (not display history)."""
+    return (
+        machine.I,
+        machine.pc,
+        machine.delay_timer,
+        machine.sound_timer,
+        tuple(machine.stack),
+        bytes(machine.V),
+        bytes(machine.memory),
+        machine.gfx.width,
+        tuple(machine.gfx.rows),
+        bytes(machine.flags),
+        machine.keyboard.state.tobytes(),
+        machine.rng.getstate(),
+    )
+
+
+def play(game_path, frames, seed=1):
+    """Yield a machine after each of frames scripted frames."""
+    machine = core.Machine(seed=seed)
+    machine.load_game(game_path)
+    clock = scheduler.Scheduler(machine, turbo=True)
+    script = bench.key_script(frames, seed)
+    for frame in range(frames):
+        bench.press_scripted(machine, script, frame)
+        clock.emulate_frame()
+        yield machine
+
+
+def test_dumps_loads_round_trip():
+    for machine in play("games/schip/ANT", 120):
+        pass
+    data = state.dumps(machine)
+
+    restored = core.Machine()
+    restored.load_game("games/schip/ANT")
+    state.loads(restored, data)
+    assert machine_state(restored) == machine_state(machine)
+    assert state.dumps(restored) == data
+
+
+def test_rewind_steps_back():
+    rewind = None
+    states = []
+    for machine in play("games/chip8/INVADERS", 200):
+        if rewind is None:
+            rewind = state.Rewind(machine, frames=150, keyframe_interval=20)
+        rewind.capture()
+        states.append(machine_state(machine))
+
+    assert len(rewind) == 150
+    for frames in (1, 5, 20, 21, 60):
+        expected = states[-frames]
+        del states[-frames:]
+        assert rewind.rewind(frames)
+        assert machine_state(machine) == expected
+    assert not rewind.rewind(len(rewind) + 1)
+
+    # Capturing resumes from a fresh keyframe
+    machine.run(500)
+    rewind.capture()
+    expected = machine_state(machine)
+    machine.run(500)
+    rewind.capture()
+    assert rewind.rewind(2)
+    assert machine_state(machine) == expected
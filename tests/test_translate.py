@@ -0,0 +1,69 @@
+import pytest
+
+from chippy import bench, core, state, translate
+from chippy.instructions import QUIRKS
+
+FRAMES = 300
+CYCLES = 18  # Instructions per frame
+
+
+def stepwise(machine):
+    """Return a runner emulating instructions one at a time (no fast-forward)."""
+
+    def run(cycles):
+        for _ in range(cycles):
+            machine.emulate_cycle()
+
+    return run
+
+
+def play(game_path, engine, frames=FRAMES, quirks=None):
+    """Yield the save state of a machine after each of frames scripted frames."""
+    machine = core.Machine(seed=1)
+    machine.load_game(game_path, quirks)
+    run = engine(machine)
+    script = bench.key_script(frames, 3)
+    for frame in range(frames):
+        bench.press_scripted(machine, script, frame)
+        run(CYCLES)
+        machine.decrement_timers()
+        yield state.dumps(machine)
+
+
+@pytest.mark.parametrize("game_path", bench.rom_paths())
+def test_blocks_match_stepwise(game_path):
+    blocks = play(game_path, lambda machine: translate.BlockTranslator(machine).run)
+    for frame, (expected, actual) in enumerate(zip(play(game_path, stepwise), blocks)):
+        assert actual == expected, "diverged on frame {}".format(frame)
+
+
+
+@pytest.mark.parametrize("quirks", sorted(QUIRKS))
+@pytest.mark.parametrize("game_path", ["games/chip8/BRIX", "games/schip/ANT"])
+def test_blocks_match_stepwise_with_quirks(game_path, quirks):
+    blocks = play(
+        game_path, lambda machine: translate.BlockTranslator(machine).run, quirks=quirks
+    )
+    stepped = play(game_path, stepwise, quirks=quirks)
+    for frame, (expected, actual) in enumerate(zip(stepped, blocks)):
+        assert actual == expected, "diverged on frame {}".format(frame)
+
+@pytest.mark.parametrize("game_path", bench.rom_paths())
+def test_idle_fast_forward_matches_stepwise(game_path):
+    # Machine.run skips the remaining iterations of idle loops
+    fast = play(game_path, lambda machine: machine.run)
+    for frame, (expected, actual) in enumerate(zip(play(game_path, stepwise), fast)):
+        assert actual == expected, "diverged on frame {}".format(frame)
+
+
+def test_idle_fast_forward_counts_executed_instructions():
+    machine = core.Machine(seed=1)
+    machine.memory[0x200:0x206] = bytes([0xF0, 0x0A, 0x12, 0x04, 0x12, 0x04])
+
+    # A key wait (FX0A) and a jump to self each execute once per run
+    assert machine.run(1000) == 1
+    assert translate.BlockTranslator(machine).run(1000) == 1
+    assert machine.pc == 0x200
+    machine.keyboard.press(5)
+    assert machine.run(1000) == 3  # FX0A, 1204, then 1204 to itself
+    assert machine.V[0] == 5 and machine.pc == 0x204
@@ -2,7 +2,7 @@
 def hex_dump_generator(memory, nbytes):
     """Return nbytes of memory, formatted as a hex string."""
     start_byte = 0
-    total_bytes = memory.size
+    total_bytes = len(memory)
 
     while start_byte < total_bytes:
         memory_slice = memory[start_byte : start_byte + nbytes]